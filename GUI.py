@@ -1,32 +1,166 @@
+import time
+# 冷启动计时的起点，尽量靠前
+STARTED = time.perf_counter()
+
 import os
 os.environ["QTWEBENGINE_DISABLE_SANDBOX"] = "1"
 os.environ["QTWEBENGINE_CHROMIUM_FLAGS"] = "--disable-gpu"
 
 import sys
+import json
+import socket
 import threading
-import os
+from datetime import datetime
+from html import escape
 from PySide6.QtWidgets import QApplication, QMainWindow, QFileDialog
-from PySide6.QtCore import QUrl
+from PySide6.QtCore import QObject, QUrl, Signal
 from PySide6.QtWebEngineWidgets import QWebEngineView
 
-import app  # 导入 Flask 应用
+# 服务就绪前显示的占位页面
+LOADING_HTML = '<html><body style="font-family: sans-serif; color: #666; text-align: center; padding-top: 30vh">正在启动…</body></html>'
+# 桌面端自身的状态（备用端口、启动耗时记录）放在用户目录下，不混入笔记数据目录
+STATE_DIR = os.path.join(os.path.expanduser('~'), '.markdown-note-system')
+# 页面来源随端口变化，编辑器的草稿备份和主题设置保存在 localStorage 中，因此优先使用固定端口；可用环境变量 GUI_PORT 修改
+PREFERRED_PORT = int(os.environ.get('GUI_PORT', 25680))
+# 启动耗时记录只保留最近的条数
+STARTUP_LOG_KEEP = 50
+
+class StartupTimer:
+    # 记录启动各阶段距进程开始的毫秒数，首页加载完成后追加到 STATE_DIR/startup_times.jsonl
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.marks = {}
+
+    def mark(self, name):
+        with self._lock:
+            self.marks.setdefault(name, round((time.perf_counter() - STARTED) * 1000, 1))
+
+    def save(self, **extra):
+        record = {'at': datetime.now().isoformat(timespec='seconds'), **extra, **self.marks}
+        path = os.path.join(STATE_DIR, 'startup_times.jsonl')
+        try:
+            os.makedirs(STATE_DIR, exist_ok=True)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    lines = f.readlines()[-(STARTUP_LOG_KEEP - 1):]
+            except FileNotFoundError:
+                lines = []
+            lines.append(json.dumps(record, ensure_ascii=False) + '\n')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+        except OSError:
+            pass
 
-def run_flask():
-    # 启动 Flask 服务（非调试模式，避免多线程下重复加载）
-    app.app.run(debug=False, use_reloader=False, port=25680)
+def load_fallback_port():
+    try:
+        with open(os.path.join(STATE_DIR, 'gui_port'), encoding='utf-8') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def save_fallback_port(port):
+    try:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        with open(os.path.join(STATE_DIR, 'gui_port'), 'w', encoding='utf-8') as f:
+            f.write(str(port))
+    except OSError:
+        pass
+
+def listen_local():
+    # 依次尝试固定端口、上次使用的备用端口，都被占用时才由系统分配，并记住分配到的端口供下次使用
+    ports = [PREFERRED_PORT]
+    fallback = load_fallback_port()
+    if fallback and fallback != PREFERRED_PORT:
+        ports.append(fallback)
+    for port in ports + [0]:
+        try:
+            sock = socket.create_server(('127.0.0.1', port))
+        except OSError:
+            continue
+        if port == 0:
+            save_fallback_port(sock.getsockname()[1])
+        return sock
+    raise OSError('无法监听本机端口')
+
+class FlaskServer(QObject):
+    # 在后台线程中导入 Flask 应用并监听本机端口；
+    # make_server 返回时套接字已在监听，此时通过 ready 信号把地址交给主线程
+    ready = Signal(str)
+    failed = Signal(str)
+
+    def __init__(self, timer):
+        super().__init__()
+        self.timer = timer
+        self.server = None
+        self.url = None
+        self.error = None
+        self._serving = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name='flask-server', daemon=True).start()
+
+    def _run(self):
+        try:
+            import app  # 导入 Flask 应用，markdown 等较重的模块在首次使用时才导入
+            from werkzeug.serving import make_server
+            self.timer.mark('app_imported')
+            os.makedirs(app.app.config['DATA_DIR'], exist_ok=True)
+            # 先自行绑定端口：werkzeug 绑定失败时会直接退出进程，无法回退到其他端口
+            sock = listen_local()
+            try:
+                # 非调试模式，多线程处理请求
+                self.server = make_server('127.0.0.1', sock.getsockname()[1], app.app, threaded=True, fd=sock.fileno())
+            finally:
+                sock.close()
+        except Exception as e:
+            self.error = str(e)
+            self.failed.emit(self.error)
+            return
+        self.timer.mark('server_listening')
+        self.url = f'http://127.0.0.1:{self.server.port}'
+        self.ready.emit(self.url)
+        self._serving.set()
+        self.server.serve_forever()
+
+    def stop(self):
+        if self._serving.is_set():
+            self.server.shutdown()
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, server, timer):
         super().__init__()
         self.setWindowTitle("Markdown Note System")
         self.resize(1024, 768)
+        self.server = server
+        self.timer = timer
+        self.url = None
+        self.timing_saved = False
 
         self.browser = QWebEngineView(self)
         self.setCentralWidget(self.browser)
+        self.browser.setHtml(LOADING_HTML)
+        self.browser.loadFinished.connect(self.handle_load_finished)
 
         # 监听下载请求以解决保存文件问题
         self.browser.page().profile().downloadRequested.connect(self.handle_download)
-        self.browser.load(QUrl("http://127.0.0.1:25680"))
+
+    def open_url(self, url):
+        # 信号与启动后的主动检查都可能调用，只加载一次
+        if self.url is not None:
+            return
+        self.url = url
+        self.browser.load(QUrl(url))
+
+    def show_error(self, message):
+        self.browser.setHtml(f'<html><body style="font-family: sans-serif; padding: 2em">服务启动失败：{escape(message)}</body></html>')
+
+    def handle_load_finished(self, ok):
+        # 占位页面也会触发 loadFinished，只统计首页
+        if not ok or self.timing_saved or self.url is None or not self.browser.url().toString().startswith(self.url):
+            return
+        self.timing_saved = True
+        self.timer.mark('page_loaded')
+        self.timer.save(url=self.url)
 
     def handle_download(self, download):
         # 获取建议的文件名
@@ -57,13 +191,23 @@ class MainWindow(QMainWindow):
         self.browser.page().runJavaScript(js_code)
 
 if __name__ == '__main__':
-    if not os.path.exists(app.app.config["DATA_DIR"]):
-        os.makedirs(app.app.config["DATA_DIR"])
-    # 后台线程启动 Flask 服务
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-
+    timer = StartupTimer()
+    timer.mark('qt_imported')
     qt_app = QApplication(sys.argv)
-    main_win = MainWindow()
+
+    # 先在后台启动服务，与创建窗口（初始化 WebEngine）同时进行
+    server = FlaskServer(timer)
+    server.start()
+
+    main_win = MainWindow(server, timer)
+    server.ready.connect(main_win.open_url)
+    server.failed.connect(main_win.show_error)
+    # 连接信号之前服务可能已经就绪或失败，补做一次检查
+    if server.url:
+        main_win.open_url(server.url)
+    elif server.error:
+        main_win.show_error(server.error)
+    qt_app.aboutToQuit.connect(server.stop)
     main_win.show()
-    sys.exit(qt_app.exec())
\ No newline at end of file
+    timer.mark('window_shown')
+    sys.exit(qt_app.exec())
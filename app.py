@@ -2,20 +2,109 @@ import os
 import json
 import uuid
 import hashlib
-import markdown
 import shutil
 import tempfile
-import zipfile
-import webbrowser
+import importlib.util
 import sys
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, abort, redirect, url_for, send_file
-from dominate import document
-from dominate.tags import div
-from dominate.util import raw
+import threading
+import sqlite3
+import re
+import math
+import heapq
+import atexit
+import time
+import unicodedata
+import zlib
+import base64
+import difflib
+import bisect
+import weakref
+from urllib.parse import quote
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import Flask, render_template, request, jsonify, abort, redirect, url_for, send_file, send_from_directory, stream_with_context
+from flask import g, has_request_context, before_render_template, template_rendered
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.security import safe_join
+
+# 跨进程文件锁：POSIX 使用 fcntl，Windows 使用 msvcrt
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Pillow 为可选依赖，未安装时图库直接使用原图；首次生成缩略图时才导入
+# markdown、dominate、zipfile 与进程池同样在首次使用时导入，缩短启动到开始监听的时间
+PIL_AVAILABLE = importlib.util.find_spec('PIL') is not None
+PILImage = None
+
+def _load_pil():
+    global PILImage
+    if PILImage is None and PIL_AVAILABLE:
+        from PIL import Image as PILImage
+    return PILImage
 
 app = Flask(__name__)
 app.config['DATA_DIR'] = os.path.join(os.path.dirname(__file__), 'data')
+# 元数据存储后端：'json'（每个项目一个 metadata.json）或 'sqlite'（首次使用时自动从 JSON 迁移）
+app.config['STORAGE_BACKEND'] = 'json'
+# SQLite 数据库路径，默认为 DATA_DIR/catalog.sqlite3
+app.config['CATALOG_DB'] = None
+# 预览渲染缓存：内存 LRU 条目数；设置 RENDER_CACHE_DIR 后同时缓存到磁盘
+app.config['RENDER_CACHE_SIZE'] = 256
+app.config['RENDER_CACHE_DIR'] = None
+# 保存笔记时在后台预先渲染预览
+app.config['PRERENDER_ON_SAVE'] = False
+# 导出项目时已压缩的文件（图片、压缩包等）直接存储，不再重复压缩
+app.config['ZIP_STORE_COMPRESSED'] = True
+# 导入项目压缩包的限制，防止超大文件与压缩炸弹
+app.config['IMPORT_MAX_ARCHIVE_SIZE'] = 512 * 1024 * 1024
+app.config['IMPORT_MAX_UNCOMPRESSED_SIZE'] = 1024 * 1024 * 1024
+app.config['IMPORT_MAX_ENTRIES'] = 10000
+app.config['IMPORT_MAX_RATIO'] = 200
+app.config['IMPORT_HASH_WORKERS'] = 4
+# 上传图片的最大字节数
+app.config['MAX_IMAGE_SIZE'] = 20 * 1024 * 1024
+# 上传图片的浏览器缓存时间（秒）；文件按内容哈希命名，不会被覆盖
+app.config['UPLOAD_CACHE_MAX_AGE'] = 365 * 24 * 3600
+# 图库缩略图：最大宽高、JPEG 质量与后台生成线程数
+app.config['THUMBNAIL_SIZE'] = (480, 480)
+app.config['THUMBNAIL_QUALITY'] = 80
+app.config['THUMBNAIL_WORKERS'] = 2
+# JSON 后端的笔记元数据变更先追加到项目的 journal.jsonl，超过该大小（字节）后在后台合并回 metadata.json
+app.config['JOURNAL_COMPACT_BYTES'] = 64 * 1024
+# images.log 累积的记录数达到该值时合并回 images.json
+app.config['IMAGE_LOG_COMPACT_THRESHOLD'] = 1000
+# 列表分页：默认每页条数与单页上限
+app.config['PAGE_SIZE'] = 30
+app.config['PAGE_SIZE_MAX'] = 200
+# 笔记版本历史：每条笔记保留最近的版本数；更早的版本在保留天数内每天保留一个
+app.config['REVISION_KEEP_RECENT'] = 50
+app.config['REVISION_KEEP_DAYS'] = 90
+# 版本内容以增量保存时，增量链的最大长度
+app.config['REVISION_DELTA_CHAIN'] = 16
+# 累计清理掉这么多条版本记录后，在后台回收不再被引用的内容对象
+app.config['REVISION_GC_THRESHOLD'] = 200
+# 完整性检查：重新计算哈希的进程数（None 为 CPU 核数）、后台任务的最小间隔（秒）与读取速率上限（字节/秒，None 为不限）
+app.config['SCRUB_PROCESSES'] = None
+app.config['SCRUB_MIN_INTERVAL'] = 300
+app.config['SCRUB_MAX_BYTES_PER_SEC'] = 32 * 1024 * 1024
+# 网页导出：渲染进程数（None 为 CPU 核数，1 为在请求线程中渲染）、每批渲染的笔记数与同时进行的导出数
+app.config['EXPORT_RENDER_PROCESSES'] = None
+app.config['EXPORT_BATCH_SIZE'] = 32
+app.config['EXPORT_MAX_CONCURRENT'] = 2
+# 批量笔记接口单次请求的最大操作数
+app.config['BATCH_MAX_OPERATIONS'] = 1000
+# 请求指标：/metrics 以 Prometheus 文本格式输出各路由延迟直方图与缓存命中率，响应附带 Server-Timing 头
+app.config['METRICS_ENABLED'] = True
+# 采样分析（默认关闭）：耗时不少于该秒数的请求把调用栈采样写入 PROFILE_DIR（默认 DATA_DIR/.profiles），最多保留 PROFILE_KEEP 个文件
+app.config['PROFILE_SLOW_REQUESTS'] = None
+app.config['PROFILE_SAMPLE_INTERVAL'] = 0.005
+app.config['PROFILE_DIR'] = None
+app.config['PROFILE_KEEP'] = 100
 
 # 公共函数与类
 @app.template_filter('datetimeformat')
@@ -38,12 +127,247 @@ def serialize_object(obj):
 def compute_hash(content):
     return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
+def _file_stamp(path):
+    # 以 (mtime, size, inode) 作为文件版本标记，文件不存在时返回 None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _atomic_write(path, data, mode, encoding=None):
+    # 先写入同目录下的临时文件并 fsync，再用 os.replace 整体替换，崩溃时不会留下写了一半的文件
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with timed('disk'), open(tmp_path, mode, encoding=encoding) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def atomic_write_text(path, text):
+    _atomic_write(path, text, 'x', 'utf-8')
+
+def atomic_write_bytes(path, data):
+    _atomic_write(path, data, 'xb')
+
+def atomic_write_json(path, data, **kwargs):
+    atomic_write_text(path, json.dumps(data, **kwargs))
+
+if fcntl is not None:
+    def _lock_fd(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock_fd(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+else:
+    def _lock_fd(fd):
+        # LK_LOCK 重试约 10 秒后抛出 OSError，这里持续等待
+        os.lseek(fd, 0, os.SEEK_SET)
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+    def _unlock_fd(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+# 进程内 RLock + 跨进程文件锁；同一线程可重入，只在最外层获取/释放文件锁
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    _lock_fd(fd)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            except BaseException:
+                self._lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            try:
+                _unlock_fd(fd)
+            finally:
+                os.close(fd)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+# 弱引用登记：没有调用方持有时实例随之回收，登记表不会随访问过的路径无限增长；
+# 实例只在未被持有（也就未加锁）时才会被回收，之后再取得的新实例与之等价
+_file_locks = weakref.WeakValueDictionary()
+_file_locks_lock = threading.Lock()
+
+def get_file_lock(path):
+    # 同一路径在进程内共享一个 FileLock 实例；锁文件不删除，避免删除与加锁之间的竞争
+    path = os.path.normpath(path)
+    with _file_locks_lock:
+        lock = _file_locks.get(path)
+        if lock is None:
+            lock = _file_locks[path] = FileLock(path)
+        return lock
+
+@contextmanager
+def project_lock(data_dir, *project_ids):
+    # 按项目加锁（进程内 + 跨进程），不相关的项目互不阻塞；
+    # 多个项目按 id 排序后依次加锁，移动笔记等操作不会互相死锁；
+    # 项目目录不存在时不加锁，随后的读取会得到“项目不存在”，也不会为任意 id 留下锁文件
+    with ExitStack() as stack:
+        for project_id in sorted(set(project_ids)):
+            if not os.path.isdir(os.path.join(data_dir, project_id)):
+                continue
+            stack.enter_context(get_file_lock(os.path.join(data_dir, '.locks', f'{project_id}.lock')))
+        yield
+
+def _parse_project(project):
+    project['created_at'] = str_to_datetime(project['created_at'])
+    project['updated_at'] = str_to_datetime(project['updated_at'])
+    project['notes'] = sorted(project['notes'], key=lambda x: x['created_at'], reverse=True)
+    for note in project['notes']:
+        note['created_at'] = str_to_datetime(note['created_at'])
+        note['updated_at'] = str_to_datetime(note['updated_at'])
+    return project
+
+def _copy_project(project):
+    # 缓存中的对象为共享对象，返回给调用方前复制一份，避免请求之间互相修改
+    copied = dict(project)
+    copied['notes'] = [dict(note) for note in project['notes']]
+    return copied
+
+# 游标分页：游标为 (排序字段值, id) 的编码，按 (值, id) 做键集分页，与数据总量无关
+PAGE_SORTS = ('created_at', 'updated_at')
+
+def encode_cursor(value, item_id):
+    raw_cursor = json.dumps([_isoformat(value), item_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw_cursor).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        value, item_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(value, str) or not isinstance(item_id, str):
+        raise ValueError('Invalid cursor')
+    return value, item_id
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _keyset_page(items, sort, descending, after, limit):
+    # 内存中的列表分页；返回最多 limit + 1 条，多出的一条用于判断是否还有下一页
+    keyed = sorted((((_isoformat(item[sort]), item['id']), item) for item in items), key=lambda t: t[0], reverse=descending)
+    if after is not None:
+        keyed = [t for t in keyed if (t[0] < after if descending else t[0] > after)]
+    return [item for _, item in keyed[:limit + 1]]
+
+def _make_page(items, sort, limit):
+    items = [dict(item) for item in items]
+    next_cursor = encode_cursor(items[limit - 1][sort], items[limit - 1]['id']) if len(items) > limit else None
+    return {'items': items[:limit], 'next_cursor': next_cursor}
+
+# 进程内的项目元数据缓存
+# 读取时以调用方给出的版本标记校验（JSON 后端为 metadata.json 的 mtime/size/inode 与日志长度），写入时直接回填
+class MetadataCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._projects = {}   # meta_file -> (stamp, project, extra)
+        self._listings = {}   # data_dir -> (dir_stamp, [meta_file, ...], {meta_file, ...})
+        self.hits = 0
+        self.misses = 0
+
+    def get_project(self, meta_file, stamp):
+        with self._lock:
+            entry = self._projects.get(meta_file)
+            if stamp is not None and entry is not None and entry[0] == stamp:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if stamp is None:
+                self._projects.pop(meta_file, None)
+            return None
+
+    def peek_project(self, meta_file):
+        # 不做校验，返回 (stamp, project, extra) 或 None，用于在旧条目上增量更新
+        with self._lock:
+            return self._projects.get(meta_file)
+
+    def put_project(self, meta_file, stamp, project, extra=None):
+        with self._lock:
+            self._projects[meta_file] = (stamp, project, extra)
+            # 新出现的项目（例如导入）不在已缓存的列表中，需要使列表失效
+            data_dir = os.path.dirname(os.path.dirname(meta_file))
+            listing = self._listings.get(data_dir)
+            if listing is not None and meta_file not in listing[2]:
+                del self._listings[data_dir]
+
+    def invalidate_project(self, meta_file):
+        with self._lock:
+            self._projects.pop(meta_file, None)
+            self._listings.pop(os.path.dirname(os.path.dirname(meta_file)), None)
+
+    def get_listing(self, data_dir):
+        # 返回缓存的 metadata.json 路径列表（已排好序），目录未变时才有效；各项目是否变化由调用方逐个校验
+        dir_stamp = _file_stamp(data_dir)
+        with self._lock:
+            listing = self._listings.get(data_dir)
+            if listing is None or listing[0] != dir_stamp:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(listing[1])
+
+    def put_listing(self, data_dir, dir_stamp, meta_files):
+        with self._lock:
+            self._listings[data_dir] = (dir_stamp, meta_files, set(meta_files))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'projects': len(self._projects),
+                'listings': len(self._listings)
+            }
+
+metadata_cache = MetadataCache()
+
 # Image 类与存储
 class Image:
-    def __init__(self, filename, url):
+    def __init__(self, filename, url, file_hash=None):
         self.id = uuid.uuid4().hex
         self.filename = filename
         self.url = url
+        self.hash = file_hash or os.path.splitext(filename)[0]
         self.uploaded_at = datetime.now().isoformat()
 
     def to_dict(self):
@@ -51,47 +375,1159 @@ class Image:
             "id": self.id,
             "filename": self.filename,
             "url": self.url,
+            "hash": self.hash,
             "uploaded_at": self.uploaded_at
         }
 
+def _image_hash(image):
+    # 早期记录没有 hash 字段，文件名即为 "<sha256><扩展名>"
+    return image.get('hash') or os.path.splitext(image['filename'])[0]
+
+# 图片索引：images.json 为快照，images.log 为追加日志（每行一条 add/delete 记录）
+# 内存中按 id 与内容哈希建立索引；读取时只解析日志新增的部分，日志过长时合并回快照
+class _ImageIndex:
+    def __init__(self, filename, log_filename):
+        self.filename = filename
+        self.log_filename = log_filename
+        self.lock = threading.RLock()
+        # 追加与合并需跨进程互斥，先取 write_lock 再取 lock
+        self.write_lock = get_file_lock(os.path.join(os.path.dirname(filename), '.locks', os.path.basename(filename) + '.lock'))
+        self._snapshot_stamp = None
+        self._log_offset = 0
+        self.log_records = 0
+        self.by_id = {}
+        self.by_hash = {}
+
+    def _apply(self, record):
+        # 记录的重放是幂等的，重复读取同一段日志不会产生副作用
+        if record.get('op') == 'add':
+            image = record['image']
+            self.by_id[image['id']] = image
+            self.by_hash.setdefault(_image_hash(image), image['id'])
+        elif record.get('op') == 'delete':
+            image = self.by_id.pop(record['id'], None)
+            if image is not None and self.by_hash.get(_image_hash(image)) == image['id']:
+                del self.by_hash[_image_hash(image)]
+
+    def _reload(self):
+        self._snapshot_stamp = _file_stamp(self.filename)
+        self.by_id, self.by_hash = {}, {}
+        self._log_offset = 0
+        self.log_records = 0
+        # 读取与解析分开计时，解析大文件的开销计入 json 而非 disk
+        with timed('disk'), open(self.filename, 'rb') as f:
+            data = f.read()
+        with timed('json'):
+            images = json.loads(data)
+        for image in images:
+            self._apply({'op': 'add', 'image': image})
+
+    def refresh(self):
+        with self.lock:
+            if _file_stamp(self.filename) != self._snapshot_stamp:
+                self._reload()
+            log_size = _file_stamp(self.log_filename)
+            log_size = log_size[1] if log_size else 0
+            if log_size < self._log_offset:
+                # 日志已被其他进程合并并截断
+                self._reload()
+            if log_size == self._log_offset:
+                return
+            with timed('disk'), open(self.log_filename, 'rb') as f:
+                f.seek(self._log_offset)
+                data = f.read(log_size - self._log_offset)
+            # 只处理完整的行，尚未写完的行留到下次读取
+            end = data.rfind(b'\n') + 1
+            records = []
+            with timed('json'):
+                for line in data[:end].splitlines():
+                    if not line.strip():
+                        continue
+                    # 无法解析的行（例如之前崩溃留下的残行）跳过，不影响其余记录
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError as e:
+                        print(f'{self.log_filename}: {e}')
+            for record in records:
+                self._apply(record)
+                self.log_records += 1
+            self._log_offset += end
+
+    def append(self, record):
+        with self.write_lock, self.lock:
+            # 持有 write_lock 时没有其他写入者，_log_offset 之后只可能是崩溃留下的残行，追加前截掉
+            self.refresh()
+            with timed('disk'), open(self.log_filename, 'ab') as f:
+                if f.tell() != self._log_offset:
+                    f.truncate(self._log_offset)
+                f.write(json.dumps(serialize_object(record), ensure_ascii=False).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.refresh()
+
+    def compact(self):
+        with self.write_lock, self.lock:
+            self.refresh()
+            atomic_write_json(self.filename, serialize_object(list(self.by_id.values())), indent=2, ensure_ascii=False)
+            open(self.log_filename, 'wb').close()
+            self.refresh()
+
+_image_indexes = {}
+_image_indexes_lock = threading.Lock()
+
+# 缩略图与原图放在同一目录，文件名为 "<sha256>.thumb.jpg"；原图按内容哈希命名，缩略图同样不会变化
+def thumbnail_path(original_path):
+    return os.path.splitext(original_path)[0] + '.thumb.jpg'
+
+def generate_thumbnail(original_path):
+    pil = _load_pil()
+    if pil is None:
+        return None
+    thumb_path = thumbnail_path(original_path)
+    if os.path.exists(thumb_path):
+        return thumb_path
+    size = tuple(app.config['THUMBNAIL_SIZE'])
+    tmp_path = f'{thumb_path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with pil.open(original_path) as img:
+            # JPEG 可在解码阶段直接按比例缩小，省去大部分解码开销
+            img.draft('RGB', size)
+            img.thumbnail(size)
+            if img.mode in ('RGBA', 'LA', 'P'):
+                img = img.convert('RGBA')
+                background = pil.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel('A'))
+                img = background
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.save(tmp_path, 'JPEG', quality=app.config['THUMBNAIL_QUALITY'], optimize=True, progressive=True)
+        os.replace(tmp_path, thumb_path)
+    except (OSError, ValueError, pil.DecompressionBombError) as e:
+        print(e)
+        return None
+    finally:
+        # 保存或替换失败时不留下写了一半的临时文件
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return thumb_path
+
+_thumbnail_executor = None
+_thumbnail_executor_lock = threading.Lock()
+
+def schedule_thumbnail(original_path):
+    global _thumbnail_executor
+    if not PIL_AVAILABLE:
+        return
+    with _thumbnail_executor_lock:
+        if _thumbnail_executor is None:
+            _thumbnail_executor = ThreadPoolExecutor(max_workers=app.config['THUMBNAIL_WORKERS'])
+    _thumbnail_executor.submit(generate_thumbnail, original_path)
+
 class ImageStorage:
     def __init__(self, filename=None):
         self.filename = filename or os.path.join(app.config['DATA_DIR'], 'images.json')
+        self.log_filename = os.path.splitext(self.filename)[0] + '.log'
+        with _image_indexes_lock:
+            self._index = _image_indexes.get(self.filename)
+            if self._index is None:
+                self._index = _image_indexes[self.filename] = _ImageIndex(self.filename, self.log_filename)
         if not os.path.exists(self.filename):
-            with open(self.filename, 'w', encoding='utf-8') as f:
-                json.dump([], f)
+            with self._index.write_lock:
+                if not os.path.exists(self.filename):
+                    atomic_write_json(self.filename, [])
+
+    def lock(self):
+        # 跨进程的登记锁，用于"查重 + 登记"这类需要整体互斥的操作
+        return self._index.write_lock
 
     def get_all_images(self):
-        with open(self.filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with self._index.lock:
+            self._index.refresh()
+            return list(self._index.by_id.values())
+
+    def get_image(self, image_id):
+        with self._index.lock:
+            self._index.refresh()
+            return self._index.by_id.get(image_id)
+
+    def get_image_by_hash(self, file_hash):
+        with self._index.lock:
+            self._index.refresh()
+            image_id = self._index.by_hash.get(file_hash)
+            return self._index.by_id.get(image_id) if image_id else None
+
+    def page_images(self, descending=True, cursor=None, limit=30):
+        # 图片只有上传时间，created_at 与 updated_at 均按 uploaded_at 排序
+        after = decode_cursor(cursor) if cursor else None
+        with self._index.lock:
+            self._index.refresh()
+            images = list(self._index.by_id.values())
+        items = _keyset_page(images, 'uploaded_at', descending, after, limit)
+        return _make_page(items, 'uploaded_at', limit)
 
     def add_image(self, image_dict):
-        images = self.get_all_images()
-        images.append(image_dict)
-        with open(self.filename, 'w', encoding='utf-8') as f:
-            json.dump(serialize_object(images), f, indent=2, ensure_ascii=False)
+        with self._index.write_lock:
+            self._index.append({'op': 'add', 'image': image_dict})
+            self._maybe_compact()
+
+    def delete_image(self, image_id):
+        with self._index.write_lock:
+            image = self.get_image(image_id)
+            if image is None:
+                return None
+            self._index.append({'op': 'delete', 'id': image_id})
+            self._maybe_compact()
+            return image
+
+    def _maybe_compact(self):
+        if self._index.log_records >= app.config['IMAGE_LOG_COMPACT_THRESHOLD']:
+            self._index.compact()
+
+def _apply_journal_records(project, records):
+    # 记录中的时间为 ISO 字符串；重放是幂等的，同一条记录应用多次结果不变
+    if not records:
+        return
+    notes = {n['id']: n for n in project['notes']}
+    for record in records:
+        if record['op'] in ('add', 'update'):
+            note = dict(record['note'])
+            if record['op'] == 'update' and note['id'] not in notes:
+                continue
+            note['created_at'] = str_to_datetime(note['created_at'])
+            note['updated_at'] = str_to_datetime(note['updated_at'])
+            notes[note['id']] = note
+        elif record['op'] == 'remove':
+            notes.pop(record['id'], None)
+        project['updated_at'] = str_to_datetime(record['updated_at'])
+    project['notes'] = sorted(notes.values(), key=lambda x: x['created_at'], reverse=True)
+
+_journal_executor = None
+_journal_pending = set()
+_journal_lock = threading.Lock()
+
+def schedule_journal_compaction(data_dir, project_id):
+    # 在后台线程中把日志合并回 metadata.json，同一项目排队中的合并只保留一个
+    global _journal_executor
+    key = (data_dir, project_id)
+    with _journal_lock:
+        if key in _journal_pending:
+            return
+        _journal_pending.add(key)
+        if _journal_executor is None:
+            _journal_executor = ThreadPoolExecutor(max_workers=1)
+    _journal_executor.submit(_compact_journal, data_dir, project_id)
+
+def _compact_journal(data_dir, project_id):
+    with _journal_lock:
+        _journal_pending.discard((data_dir, project_id))
+    try:
+        with project_lock(data_dir, project_id):
+            JsonCatalog(data_dir).compact_journal(project_id)
+    except OSError as e:
+        print(e)
+
+# 元数据目录（catalog）：负责项目与笔记元数据的持久化，笔记正文始终保存在 <note_id>.md 中
+# JsonCatalog 为默认实现，每个项目一个 metadata.json
+# 单条笔记的增删改只追加到 journal.jsonl，读取时重放；整体保存 metadata.json 时日志随之清空。
+# metadata.json 中的 journal_token 标识当前快照，日志记录带有写入时的 token，
+# 合并后、清空日志前崩溃留下的旧记录因 token 不匹配而被忽略
+class JsonCatalog:
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+
+    def _meta_file(self, project_id):
+        return os.path.join(self.data_dir, project_id, 'metadata.json')
+
+    def _journal_file(self, project_id):
+        return os.path.join(self.data_dir, project_id, 'journal.jsonl')
+
+    def _load(self, project_id):
+        # 返回 (project, stamp, token)；stamp 为 (metadata.json 的文件标记, 已重放的日志字节数)
+        meta_file = self._meta_file(project_id)
+        meta_stamp = _file_stamp(meta_file)
+        journal_stamp = _file_stamp(self._journal_file(project_id))
+        stamp = (meta_stamp, journal_stamp[1] if journal_stamp else 0) if meta_stamp else None
+        project = metadata_cache.get_project(meta_file, stamp)
+        if stamp is None:
+            return None, None, None
+        entry = metadata_cache.peek_project(meta_file)
+        if project is not None:
+            return project, stamp, entry[2]
+        if entry is not None and entry[0][0] == meta_stamp and entry[0][1] <= stamp[1]:
+            # metadata.json 未变，只重放日志新增的部分
+            project, offset, token = _copy_project(entry[1]), entry[0][1], entry[2]
+        else:
+            # 先取版本标记再读取，若读取期间文件被替换，下次校验时会重新加载
+            with timed('disk'), open(meta_file, 'rb') as f:
+                data = f.read()
+            with timed('json'):
+                data = json.loads(data)
+            token = data.pop('journal_token', None)
+            project, offset = _parse_project(data), 0
+        offset = self._replay_journal(project_id, project, token, offset)
+        stamp = (meta_stamp, offset)
+        metadata_cache.put_project(meta_file, stamp, project, token)
+        return project, stamp, token
+
+    def _replay_journal(self, project_id, project, token, offset):
+        try:
+            with timed('disk'), open(self._journal_file(project_id), 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return offset
+        # 只处理完整的行，崩溃时写了一半的记录在下次追加前被截掉
+        end = data.rfind(b'\n') + 1
+        with timed('json'):
+            records = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+        _apply_journal_records(project, [r for r in records if r.get('token') == token])
+        return offset + end
+
+    def _append_journal(self, project_id, records):
+        # 调用方需持有项目锁
+        project, stamp, token = self._load(project_id)
+        data = b''.join(json.dumps(serialize_object({'token': token, **record}), ensure_ascii=False).encode('utf-8') + b'\n'
+                        for record in records)
+        with timed('disk'), open(self._journal_file(project_id), 'ab') as f:
+            if f.tell() != stamp[1]:
+                f.truncate(stamp[1])
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # 写穿缓存
+        project = _copy_project(project)
+        _apply_journal_records(project, json.loads(json.dumps(serialize_object(records))))
+        offset = stamp[1] + len(data)
+        metadata_cache.put_project(self._meta_file(project_id), (stamp[0], offset), project, token)
+        if offset >= app.config['JOURNAL_COMPACT_BYTES']:
+            schedule_journal_compaction(self.data_dir, project_id)
+
+    def compact_journal(self, project_id):
+        # 调用方需持有项目锁
+        project, stamp, _ = self._load(project_id)
+        if project is not None and stamp[1]:
+            self.save_project(project_id, _copy_project(project))
+
+    def load_project(self, project_id):
+        return self._load(project_id)[0]
+
+    def list_projects(self):
+        # 列表缓存只省去遍历目录和排序；每个项目仍按 metadata.json 与 journal.jsonl 的标记校验，其他进程的修改也能读到
+        meta_files = metadata_cache.get_listing(self.data_dir)
+        if meta_files is not None:
+            projects = [self.load_project(os.path.basename(os.path.dirname(meta_file))) for meta_file in meta_files]
+            if None not in projects:
+                return projects
+        dir_stamp = _file_stamp(self.data_dir)
+        projects = []
+        for dir_name in os.listdir(self.data_dir):
+            project = self.load_project(dir_name)
+            if project is not None:
+                projects.append(project)
+        projects.sort(key=lambda x: x['created_at'], reverse=True)
+        metadata_cache.put_listing(self.data_dir, dir_stamp, [self._meta_file(p['id']) for p in projects])
+        return projects
+
+    def has_project(self, project_id):
+        return self.load_project(project_id) is not None
+
+    def get_project_info(self, project_id):
+        project = self.load_project(project_id)
+        if project is None:
+            return None
+        return {k: v for k, v in project.items() if k != 'notes'}
+
+    def page_projects(self, sort, descending, after, limit):
+        return _keyset_page(self.list_projects(), sort, descending, after, limit)
+
+    def page_notes(self, project_id, sort, descending, after, limit):
+        project = self.load_project(project_id)
+        if project is None:
+            return None
+        return _keyset_page(project['notes'], sort, descending, after, limit)
+
+    def iter_notes(self):
+        for project in self.list_projects():
+            for note in project['notes']:
+                yield project['id'], note
+
+    def get_note(self, project_id, note_id):
+        project = self.load_project(project_id)
+        if project is None:
+            return None
+        return next((n for n in project['notes'] if n['id'] == note_id), None)
+
+    def save_project(self, project_id, metadata):
+        meta_file = self._meta_file(project_id)
+        data = serialize_object(metadata)
+        token = uuid.uuid4().hex
+        atomic_write_json(meta_file, {**data, 'journal_token': token}, ensure_ascii=False, indent=2)
+        # 新快照已包含日志中的全部变更
+        if os.path.exists(self._journal_file(project_id)):
+            os.remove(self._journal_file(project_id))
+        # 写穿缓存：serialize_object 已生成独立副本，可直接解析后放入缓存
+        metadata_cache.put_project(meta_file, (_file_stamp(meta_file), 0), _parse_project(data), token)
+
+    def add_note(self, project_id, note_meta, updated_at):
+        self._append_journal(project_id, [{'op': 'add', 'note': note_meta, 'updated_at': updated_at}])
+
+    def update_note(self, project_id, note_meta, updated_at):
+        self._append_journal(project_id, [{'op': 'update', 'note': note_meta, 'updated_at': updated_at}])
+
+    def remove_note(self, project_id, note_id, updated_at):
+        note_meta = self.get_note(project_id, note_id)
+        if note_meta is None:
+            return None
+        self._append_journal(project_id, [{'op': 'remove', 'id': note_id, 'updated_at': updated_at}])
+        return dict(note_meta)
+
+    def move_note(self, project_id, note_id, target_project_id, updated_at):
+        note_meta = self.remove_note(project_id, note_id, updated_at)
+        if note_meta is None:
+            return None
+        note_meta['updated_at'] = updated_at
+        self.add_note(target_project_id, note_meta, updated_at)
+        return note_meta
+
+    def apply_note_changes(self, project_id, added, updated, removed_ids, moved, updated_at):
+        # 批量修改：每个涉及的项目只读写一次 metadata.json
+        project = _copy_project(self.load_project(project_id))
+        replaced = {n['id']: n for n in updated}
+        gone = set(removed_ids) | {n['id'] for notes in moved.values() for n in notes}
+        project['notes'] = [replaced.get(n['id'], n) for n in project['notes'] if n['id'] not in gone] + list(added)
+        project['updated_at'] = updated_at
+        self.save_project(project_id, project)
+        for target_project_id, notes in moved.items():
+            target = _copy_project(self.load_project(target_project_id))
+            target['notes'].extend(notes)
+            target['updated_at'] = updated_at
+            self.save_project(target_project_id, target)
+
+    def delete_project(self, project_id):
+        metadata_cache.invalidate_project(self._meta_file(project_id))
+
+_CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS notes (
+    project_id TEXT NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    hash TEXT,
+    extra TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (project_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_projects_created_at ON projects(created_at);
+CREATE INDEX IF NOT EXISTS idx_projects_updated_at ON projects(updated_at);
+CREATE INDEX IF NOT EXISTS idx_notes_id ON notes(id);
+CREATE INDEX IF NOT EXISTS idx_notes_created_at ON notes(project_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_notes_updated_at ON notes(project_id, updated_at);
+CREATE TABLE IF NOT EXISTS catalog_info (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_PROJECT_COLUMNS = ('id', 'name', 'created_at', 'updated_at')
+_NOTE_COLUMNS = ('id', 'title', 'created_at', 'updated_at', 'hash')
+
+def _split_extra(record, columns):
+    return json.dumps(serialize_object({k: v for k, v in record.items() if k not in columns and k != 'notes'}), ensure_ascii=False)
+
+def _row_to_project(row):
+    project = {
+        'id': row['id'],
+        'name': row['name'],
+        'created_at': str_to_datetime(row['created_at']),
+        'updated_at': str_to_datetime(row['updated_at'])
+    }
+    project.update(json.loads(row['extra']))
+    return project
+
+def _row_to_note(row):
+    note = {
+        'id': row['id'],
+        'title': row['title'],
+        'created_at': str_to_datetime(row['created_at']),
+        'updated_at': str_to_datetime(row['updated_at']),
+        'hash': row['hash']
+    }
+    note.update(json.loads(row['extra']))
+    return note
+
+def _sqlite_write_project(conn, project):
+    conn.execute(
+        'INSERT INTO projects (id, name, created_at, updated_at, extra) VALUES (?, ?, ?, ?, ?) '
+        'ON CONFLICT(id) DO UPDATE SET name=excluded.name, created_at=excluded.created_at, '
+        'updated_at=excluded.updated_at, extra=excluded.extra',
+        (project['id'], project['name'], _isoformat(project['created_at']),
+         _isoformat(project['updated_at']), _split_extra(project, _PROJECT_COLUMNS))
+    )
+    conn.execute('DELETE FROM notes WHERE project_id = ?', (project['id'],))
+    conn.executemany(
+        'INSERT OR REPLACE INTO notes (project_id, id, title, created_at, updated_at, hash, extra) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [(project['id'], n['id'], n['title'], _isoformat(n['created_at']), _isoformat(n['updated_at']),
+          n.get('hash'), _split_extra(n, _NOTE_COLUMNS)) for n in project.get('notes', [])]
+    )
+
+def migrate_json_catalog(data_dir, conn):
+    # 一次性迁移：把现有的 metadata.json 导入 SQLite，原文件保留作为备份，迁移后不再更新
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        if conn.execute("SELECT 1 FROM catalog_info WHERE key = 'migrated_from_json'").fetchone():
+            return 0
+        projects = JsonCatalog(data_dir).list_projects()
+        for project in projects:
+            _sqlite_write_project(conn, project)
+        conn.execute("INSERT INTO catalog_info (key, value) VALUES ('migrated_from_json', ?)", (datetime.now().isoformat(),))
+    return len(projects)
+
+_sqlite_local = threading.local()
+_sqlite_ready = set()
+_sqlite_ready_lock = threading.Lock()
+
+# SqliteCatalog：元数据保存在本地 SQLite 中，笔记的增删改移均为单行写入
+class SqliteCatalog:
+    def __init__(self, data_dir, db_path):
+        self.data_dir = data_dir
+        self.db_path = db_path
+        self.conn = self._connect()
+
+    def _connect(self):
+        # 每个线程复用一个连接；建表与迁移每个进程只执行一次
+        conns = getattr(_sqlite_local, 'conns', None)
+        if conns is None:
+            conns = _sqlite_local.conns = {}
+        conn = conns.get(self.db_path)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            conns[self.db_path] = conn
+        with _sqlite_ready_lock:
+            if self.db_path not in _sqlite_ready:
+                conn.executescript(_CATALOG_SCHEMA)
+                migrate_json_catalog(self.data_dir, conn)
+                _sqlite_ready.add(self.db_path)
+        return conn
+
+    def _touch_project(self, project_id, updated_at):
+        self.conn.execute('UPDATE projects SET updated_at = ? WHERE id = ?', (_isoformat(updated_at), project_id))
+
+    def load_project(self, project_id):
+        row = self.conn.execute('SELECT * FROM projects WHERE id = ?', (project_id,)).fetchone()
+        if row is None:
+            return None
+        project = _row_to_project(row)
+        rows = self.conn.execute('SELECT * FROM notes WHERE project_id = ? ORDER BY created_at DESC', (project_id,))
+        project['notes'] = [_row_to_note(r) for r in rows]
+        return project
+
+    def list_projects(self):
+        # 列表只返回项目本身的字段，不加载笔记
+        rows = self.conn.execute('SELECT * FROM projects ORDER BY created_at DESC')
+        return [_row_to_project(r) for r in rows]
+
+    def has_project(self, project_id):
+        return self.conn.execute('SELECT 1 FROM projects WHERE id = ?', (project_id,)).fetchone() is not None
+
+    def get_project_info(self, project_id):
+        row = self.conn.execute('SELECT * FROM projects WHERE id = ?', (project_id,)).fetchone()
+        return _row_to_project(row) if row else None
+
+    def _keyset_query(self, table, where, params, sort, descending, after, limit):
+        # sort 只允许 PAGE_SORTS 中的列名，由调用方校验
+        op, direction = ('<', 'DESC') if descending else ('>', 'ASC')
+        sql = f'SELECT * FROM {table} WHERE {where}'
+        if after is not None:
+            sql += f' AND ({sort} {op} ? OR ({sort} = ? AND id {op} ?))'
+            params = params + (after[0], after[0], after[1])
+        sql += f' ORDER BY {sort} {direction}, id {direction} LIMIT ?'
+        return self.conn.execute(sql, params + (limit + 1,)).fetchall()
+
+    def page_projects(self, sort, descending, after, limit):
+        rows = self._keyset_query('projects', '1 = 1', (), sort, descending, after, limit)
+        return [_row_to_project(r) for r in rows]
+
+    def page_notes(self, project_id, sort, descending, after, limit):
+        if not self.has_project(project_id):
+            return None
+        rows = self._keyset_query('notes', 'project_id = ?', (project_id,), sort, descending, after, limit)
+        return [_row_to_note(r) for r in rows]
+
+    def iter_notes(self):
+        for row in self.conn.execute('SELECT * FROM notes').fetchall():
+            yield row['project_id'], _row_to_note(row)
+
+    def get_note(self, project_id, note_id):
+        row = self.conn.execute('SELECT * FROM notes WHERE project_id = ? AND id = ?', (project_id, note_id)).fetchone()
+        return _row_to_note(row) if row else None
+
+    def save_project(self, project_id, metadata):
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            _sqlite_write_project(self.conn, {**metadata, 'id': project_id})
+
+    def add_note(self, project_id, note_meta, updated_at):
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute(
+                'INSERT INTO notes (project_id, id, title, created_at, updated_at, hash, extra) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (project_id, note_meta['id'], note_meta['title'], _isoformat(note_meta['created_at']),
+                 _isoformat(note_meta['updated_at']), note_meta.get('hash'), _split_extra(note_meta, _NOTE_COLUMNS))
+            )
+            self._touch_project(project_id, updated_at)
+
+    def update_note(self, project_id, note_meta, updated_at):
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute(
+                'UPDATE notes SET title = ?, updated_at = ?, hash = ?, extra = ? WHERE project_id = ? AND id = ?',
+                (note_meta['title'], _isoformat(note_meta['updated_at']), note_meta.get('hash'),
+                 _split_extra(note_meta, _NOTE_COLUMNS), project_id, note_meta['id'])
+            )
+            self._touch_project(project_id, updated_at)
+
+    def remove_note(self, project_id, note_id, updated_at):
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            note_meta = self.get_note(project_id, note_id)
+            if note_meta is None:
+                return None
+            self.conn.execute('DELETE FROM notes WHERE project_id = ? AND id = ?', (project_id, note_id))
+            self._touch_project(project_id, updated_at)
+        return note_meta
+
+    def move_note(self, project_id, note_id, target_project_id, updated_at):
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            note_meta = self.get_note(project_id, note_id)
+            if note_meta is None:
+                return None
+            self.conn.execute(
+                'UPDATE notes SET project_id = ?, updated_at = ? WHERE project_id = ? AND id = ?',
+                (target_project_id, _isoformat(updated_at), project_id, note_id)
+            )
+            self._touch_project(project_id, updated_at)
+            self._touch_project(target_project_id, updated_at)
+        note_meta['updated_at'] = updated_at
+        return note_meta
+
+    def apply_note_changes(self, project_id, added, updated, removed_ids, moved, updated_at):
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.executemany(
+                'INSERT INTO notes (project_id, id, title, created_at, updated_at, hash, extra) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(project_id, n['id'], n['title'], _isoformat(n['created_at']), _isoformat(n['updated_at']),
+                  n.get('hash'), _split_extra(n, _NOTE_COLUMNS)) for n in added]
+            )
+            self.conn.executemany(
+                'UPDATE notes SET title = ?, updated_at = ?, hash = ?, extra = ? WHERE project_id = ? AND id = ?',
+                [(n['title'], _isoformat(n['updated_at']), n.get('hash'), _split_extra(n, _NOTE_COLUMNS),
+                  project_id, n['id']) for n in updated]
+            )
+            self.conn.executemany('DELETE FROM notes WHERE project_id = ? AND id = ?', [(project_id, note_id) for note_id in removed_ids])
+            for target_project_id, notes in moved.items():
+                self.conn.executemany(
+                    'UPDATE notes SET project_id = ?, title = ?, updated_at = ?, hash = ?, extra = ? WHERE project_id = ? AND id = ?',
+                    [(target_project_id, n['title'], _isoformat(n['updated_at']), n.get('hash'),
+                      _split_extra(n, _NOTE_COLUMNS), project_id, n['id']) for n in notes]
+                )
+                self._touch_project(target_project_id, updated_at)
+            self._touch_project(project_id, updated_at)
+
+    def delete_project(self, project_id):
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute('DELETE FROM projects WHERE id = ?', (project_id,))
+
+# ---------------------- 全文检索 ----------------------
+# 中日韩文字没有空格分词：连续的 CJK 字符同时索引单字和相邻二元组，其余按单词切分
+_CJK_RANGES = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_TOKEN_RE = re.compile(f'([{_CJK_RANGES}]+)|([^\\W{_CJK_RANGES}]+)')
+
+def tokenize(text, for_query=False):
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        word = match.group()
+        if match.group(1):
+            bigrams = [word[i:i + 2] for i in range(len(word) - 1)]
+            # 查询时只用二元组即可精确定位；单字查询时退回到单字
+            if for_query:
+                tokens.extend(bigrams or [word])
+            else:
+                tokens.extend(word)
+                tokens.extend(bigrams)
+        else:
+            tokens.append(word)
+    return tokens
+
+def _term_frequencies(tokens):
+    tf = {}
+    for token in tokens:
+        tf[token] = tf.get(token, 0) + 1
+    return tf
+
+class SearchIndex:
+    TITLE_BOOST = 3
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, 'search_index.json')
+        self._lock = threading.RLock()
+        self._docs = {}       # (project_id, note_id) -> {'title', 'hash', 'content_tf', 'length'}
+        self._postings = {}   # token -> {(project_id, note_id): weight}
+        self._total_length = 0
+        self._loaded = False
+        self._pending = 0
+        self._flush_scheduled = False
+        # 串行化快照写入，先取得的快照不会覆盖后取得的
+        self._flush_lock = threading.Lock()
+
+    # --- 内部：倒排表维护 ---
+    def _add_doc(self, key, title, note_hash, content_tf):
+        weights = dict(content_tf)
+        for token, count in _term_frequencies(tokenize(title)).items():
+            weights[token] = weights.get(token, 0) + count * self.TITLE_BOOST
+        length = sum(weights.values())
+        self._docs[key] = {'title': title, 'hash': note_hash, 'content_tf': content_tf, 'length': length}
+        for token, weight in weights.items():
+            self._postings.setdefault(token, {})[key] = weight
+        self._total_length += length
+
+    def _remove_doc(self, key):
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return None
+        for token in set(doc['content_tf']).union(tokenize(doc['title'])):
+            posting = self._postings.get(token)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self._postings[token]
+        self._total_length -= doc['length']
+        return doc
+
+    def _mark_dirty(self):
+        # 调用方需持有 _lock；快照写入交给后台线程，保存请求不等待序列化整个索引
+        self._pending += 1
+        if self._pending >= 100:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        global _search_flush_executor
+        with self._lock:
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        with _search_flush_executor_lock:
+            if _search_flush_executor is None:
+                _search_flush_executor = ThreadPoolExecutor(max_workers=1)
+        _search_flush_executor.submit(self._background_flush)
+
+    def _background_flush(self):
+        try:
+            self.flush()
+        except OSError as e:
+            print(e)
+
+    # --- 加载与同步 ---
+    def ensure_loaded(self, storage):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        snapshot = json.load(f)
+                    for project_id, note_id, title, note_hash, content_tf in snapshot['docs']:
+                        self._add_doc((project_id, note_id), title, note_hash, content_tf)
+                except (ValueError, KeyError, TypeError):
+                    self._docs, self._postings, self._total_length = {}, {}, 0
+            self._sync(storage)
+            self._loaded = True
+            if self._pending:
+                self._schedule_flush()
+
+    def _sync(self, storage):
+        # 与 catalog 对账：哈希一致的笔记无需重新读取和分词
+        seen = set()
+        for project_id, note_meta in storage.catalog.iter_notes():
+            key = (project_id, note_meta['id'])
+            seen.add(key)
+            doc = self._docs.get(key)
+            if doc is not None and doc['hash'] == note_meta.get('hash'):
+                if doc['title'] != note_meta['title']:
+                    self._remove_doc(key)
+                    self._add_doc(key, note_meta['title'], doc['hash'], doc['content_tf'])
+                    self._pending += 1
+                continue
+            content = storage.get_note_content(project_id, note_meta['id'])
+            if content is None:
+                continue
+            self._remove_doc(key)
+            self._add_doc(key, note_meta['title'], note_meta.get('hash'), _term_frequencies(tokenize(content)))
+            self._pending += 1
+        for key in [k for k in self._docs if k not in seen]:
+            self._remove_doc(key)
+            self._pending += 1
+
+    def flush(self):
+        # 锁内只收集文档的引用（content_tf 建立后不再修改），序列化与写盘在锁外进行，不阻塞搜索与保存
+        with self._flush_lock:
+            with self._lock:
+                self._flush_scheduled = False
+                pending = self._pending
+                if not pending:
+                    return
+                docs = [[k[0], k[1], d['title'], d['hash'], d['content_tf']] for k, d in self._docs.items()]
+                self._pending = 0
+            try:
+                atomic_write_json(self.path, {'docs': docs}, ensure_ascii=False, separators=(',', ':'))
+            except BaseException:
+                with self._lock:
+                    self._pending += pending
+                raise
+
+    # --- 增量更新：索引尚未加载时直接跳过，加载时会按哈希对账 ---
+    def update_note(self, project_id, note_meta, content):
+        if not self._loaded:
+            return
+        key = (project_id, note_meta['id'])
+        with self._lock:
+            doc = self._docs.get(key)
+            if doc is not None and doc['hash'] == note_meta.get('hash'):
+                if doc['title'] == note_meta['title']:
+                    return
+                content_tf = doc['content_tf']
+            else:
+                content_tf = _term_frequencies(tokenize(content))
+            self._remove_doc(key)
+            self._add_doc(key, note_meta['title'], note_meta.get('hash'), content_tf)
+            self._mark_dirty()
+
+    def remove_note(self, project_id, note_id):
+        if not self._loaded:
+            return
+        with self._lock:
+            if self._remove_doc((project_id, note_id)) is not None:
+                self._mark_dirty()
+
+    def move_note(self, project_id, note_id, target_project_id):
+        if not self._loaded:
+            return
+        with self._lock:
+            doc = self._remove_doc((project_id, note_id))
+            if doc is not None:
+                self._add_doc((target_project_id, note_id), doc['title'], doc['hash'], doc['content_tf'])
+                self._mark_dirty()
+
+    def remove_project(self, project_id):
+        if not self._loaded:
+            return
+        with self._lock:
+            for key in [k for k in self._docs if k[0] == project_id]:
+                self._remove_doc(key)
+            self._mark_dirty()
+
+    # --- 查询：所有词项都需命中，按 BM25 排序 ---
+    def search(self, query, project_id=None, limit=20):
+        tokens = list(dict.fromkeys(tokenize(query, for_query=True)))
+        if not tokens:
+            return []
+        with self._lock:
+            postings = [self._postings.get(token) for token in tokens]
+            if any(p is None for p in postings):
+                return []
+            postings.sort(key=len)
+            candidates = [key for key in postings[0] if project_id is None or key[0] == project_id]
+            for posting in postings[1:]:
+                candidates = [key for key in candidates if key in posting]
+                if not candidates:
+                    return []
+            doc_count = len(self._docs)
+            avg_length = self._total_length / doc_count if doc_count else 1
+            idf = [math.log(1 + (doc_count - len(p) + 0.5) / (len(p) + 0.5)) for p in postings]
+            terms = list(zip(idf, postings))
+            docs = self._docs
+            k1, b = self.K1, self.B
+
+            # 以 key 函数交给 nlargest，避免为每个候选文档创建元组（大结果集时会频繁触发 GC）
+            def score(key):
+                norm = k1 * (1 - b + b * docs[key]['length'] / avg_length)
+                total = 0.0
+                for term_idf, posting in terms:
+                    tf = posting[key]
+                    total += term_idf * tf * (k1 + 1) / (tf + norm)
+                return total
+
+            top = heapq.nlargest(limit, candidates, key=score)
+            return [{
+                'project_id': key[0],
+                'note_id': key[1],
+                'title': docs[key]['title'],
+                'score': round(score(key), 4)
+            } for key in top]
+
+_search_indexes = {}
+_search_indexes_lock = threading.Lock()
+_search_flush_executor = None
+_search_flush_executor_lock = threading.Lock()
+
+def get_search_index(data_dir):
+    with _search_indexes_lock:
+        index = _search_indexes.get(data_dir)
+        if index is None:
+            index = _search_indexes[data_dir] = SearchIndex(data_dir)
+            atexit.register(index.flush)
+        return index
+
+# ---------------------- 版本历史 ----------------------
+# 笔记内容按 compute_hash 的 SHA-256 存为内容寻址对象（DATA_DIR/.revisions/objects/<前两位>/<hash>），相同内容只存一份。
+# 对象为 zlib 压缩的全文（b'F'），或相对于上一版本的行级增量（b'D' + 链长 + 基准哈希），增量链长度受限。
+# 每条笔记的版本记录保存在 <project_id>/.revisions/<note_id>.jsonl，每行一个版本
+class RevisionStore:
+    def __init__(self, data_dir):
+        self.objects_dir = os.path.join(data_dir, '.revisions', 'objects')
+
+    def _object_path(self, content_hash):
+        return os.path.join(self.objects_dir, content_hash[:2], content_hash)
+
+    def has(self, content_hash):
+        return os.path.exists(self._object_path(content_hash))
+
+    def _read_header(self, content_hash):
+        # 返回 (链长, 基准哈希)；全文对象的链长为 0
+        with open(self._object_path(content_hash), 'rb') as f:
+            head = f.read(66)
+        if head[:1] == b'D':
+            return head[1], head[2:66].decode('ascii')
+        return 0, None
+
+    def _touch(self, content_hash):
+        # 刷新对象及其增量基准的修改时间，重新被引用的旧对象同样受 gc 宽限期保护；有对象缺失时返回 False
+        while content_hash:
+            try:
+                os.utime(self._object_path(content_hash))
+                content_hash = self._read_header(content_hash)[1]
+            except FileNotFoundError:
+                return False
+        return True
+
+    def put(self, content, content_hash, base_hash=None):
+        if self._touch(content_hash):
+            return
+        data = b'F' + zlib.compress(content.encode('utf-8'))
+        if base_hash and self._touch(base_hash):
+            depth = self._read_header(base_hash)[0] + 1
+            base_content = self.get(base_hash)
+            if depth <= app.config['REVISION_DELTA_CHAIN'] and base_content is not None:
+                delta = b'D' + bytes([depth]) + base_hash.encode('ascii') + zlib.compress(
+                    json.dumps(_make_delta(base_content, content), ensure_ascii=False).encode('utf-8'))
+                # 增量明显更小时才使用，避免改动较大时读取还要额外解一层
+                if len(delta) * 2 < len(data):
+                    data = delta
+        path = self._object_path(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write_bytes(path, data)
+
+    def get(self, content_hash):
+        # 沿增量链找到全文后逐层应用；对象缺失或内容与哈希不符时返回 None
+        chain = []
+        current = content_hash
+        while True:
+            try:
+                with timed('disk'), open(self._object_path(current), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return None
+            if data[:1] != b'D':
+                content = zlib.decompress(data[1:]).decode('utf-8')
+                break
+            chain.append(json.loads(zlib.decompress(data[66:])))
+            current = data[2:66].decode('ascii')
+        for ops in reversed(chain):
+            content = _apply_delta(content, ops)
+        return content if compute_hash(content) == content_hash else None
+
+    def gc(self, live_hashes, grace_seconds=3600):
+        # 标记：被版本记录引用的对象及其增量基准；清除：其余对象（刚写入的对象留到下次，避免与并发保存冲突）
+        live = set()
+        for content_hash in live_hashes:
+            while content_hash and content_hash not in live and self.has(content_hash):
+                live.add(content_hash)
+                content_hash = self._read_header(content_hash)[1]
+        removed = 0
+        freed = 0
+        deadline = time.time() - grace_seconds
+        if not os.path.isdir(self.objects_dir):
+            return {'live': len(live), 'removed': 0, 'freed_bytes': 0}
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            for name in os.listdir(prefix_dir):
+                path = os.path.join(prefix_dir, name)
+                st = os.stat(path)
+                if name not in live and st.st_mtime < deadline:
+                    os.remove(path)
+                    removed += 1
+                    freed += st.st_size
+        return {'live': len(live), 'removed': removed, 'freed_bytes': freed}
+
+def _make_delta(base, content):
+    # 行级增量：[起, 止] 表示复制基准的这些行，字符串表示插入的文本
+    base_lines = base.splitlines(keepends=True)
+    lines = content.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, base_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(lines[j1:j2]))
+    return ops
+
+def _apply_delta(base, ops):
+    base_lines = base.splitlines(keepends=True)
+    return ''.join(''.join(base_lines[op[0]:op[1]]) if isinstance(op, list) else op for op in ops)
+
+def _load_revision_log(log_file):
+    # 返回 (版本列表, 最后一个完整行之后的字节偏移)；崩溃时写了一半的行与无法解析的行跳过，不影响之后的保存
+    try:
+        with open(log_file, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0
+    end = data.rfind(b'\n') + 1
+    entries = []
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError as e:
+            print(f'{log_file}: {e}')
+            continue
+        if isinstance(entry, dict) and 'hash' in entry:
+            entries.append(entry)
+    return entries, end
+
+def _read_revision_log(log_file):
+    return _load_revision_log(log_file)[0]
+
+def _prune_revisions(entries, now):
+    # 保留最近 REVISION_KEEP_RECENT 个版本；更早的版本在 REVISION_KEEP_DAYS 天内每天只保留最后一个
+    keep_recent = app.config['REVISION_KEEP_RECENT']
+    recent = entries[-keep_recent:] if keep_recent else []
+    older = entries[:len(entries) - len(recent)]
+    cutoff = (now - timedelta(days=app.config['REVISION_KEEP_DAYS'])).isoformat()
+    daily = {}
+    for entry in older:
+        if entry['saved_at'] >= cutoff:
+            daily[entry['saved_at'][:10]] = entry
+    return list(daily.values()) + recent
+
+_revision_gc_executor = None
+_revision_gc_pending = {}
+_revision_gc_lock = threading.Lock()
+
+def schedule_revision_gc(data_dir, pruned):
+    # 累计清理的版本记录达到阈值后在后台回收对象
+    global _revision_gc_executor
+    with _revision_gc_lock:
+        _revision_gc_pending[data_dir] = _revision_gc_pending.get(data_dir, 0) + pruned
+        if _revision_gc_pending[data_dir] < app.config['REVISION_GC_THRESHOLD']:
+            return
+        _revision_gc_pending[data_dir] = 0
+        if _revision_gc_executor is None:
+            _revision_gc_executor = ThreadPoolExecutor(max_workers=1)
+    _revision_gc_executor.submit(_run_revision_gc, data_dir)
+
+def _run_revision_gc(data_dir):
+    try:
+        Storage(data_dir).gc_revisions()
+    except OSError as e:
+        print(e)
+
+# 增量保存：编辑器提交相对于 base_hash 版本的一组替换 {start, end, text}
+# 偏移量按 UTF-16 码元计算，与浏览器端 JavaScript 字符串的下标一致
+class NoteConflictError(Exception):
+    def __init__(self, current_hash):
+        super().__init__('Note has been modified')
+        self.current_hash = current_hash
+
+def apply_text_edits(content, edits):
+    # 替换区间基于原文，需按顺序排列且互不重叠；非法时抛出 ValueError
+    units = content.encode('utf-16-le')
+    length = len(units) // 2
+    parts = []
+    position = 0
+    for edit in edits:
+        if not isinstance(edit, dict):
+            raise ValueError('Invalid edit')
+        start, end, text = edit.get('start'), edit.get('end'), edit.get('text', '')
+        if not all(isinstance(v, int) and not isinstance(v, bool) for v in (start, end)) or not isinstance(text, str):
+            raise ValueError('Invalid edit')
+        if not position <= start <= end <= length:
+            raise ValueError('Edits out of range or overlapping')
+        parts.append(units[position * 2:start * 2])
+        parts.append(text.encode('utf-16-le', 'surrogatepass'))
+        position = end
+    parts.append(units[position * 2:])
+    try:
+        return b''.join(parts).decode('utf-16-le')
+    except UnicodeDecodeError:
+        raise ValueError('Edits split a surrogate pair')
+
+def _validate_note_operation(operation):
+    # 批量操作的字段类型检查，返回错误信息或 None
+    if operation.get('op') in ('update', 'delete', 'move') and not isinstance(operation.get('id'), str):
+        return 'Invalid id'
+    for field in ('title', 'content', 'target_project_id'):
+        if operation.get(field) is not None and not isinstance(operation[field], str):
+            return f'Invalid {field}'
+    return None
 
 # Storage 类，用于项目及笔记管理
 class Storage:
-    def __init__(self, data_dir=None):
-        self.data_dir = data_dir or app.config['DATA_DIR']
+    def __init__(self, data_dir=None, backend=None):
+        self.data_dir = os.path.normpath(data_dir or app.config['DATA_DIR'])
         os.makedirs(self.data_dir, exist_ok=True)
+        self.backend = backend or app.config['STORAGE_BACKEND']
+        if self.backend == 'sqlite':
+            db_path = app.config['CATALOG_DB'] or os.path.join(self.data_dir, 'catalog.sqlite3')
+            self.catalog = SqliteCatalog(self.data_dir, db_path)
+        else:
+            self.catalog = JsonCatalog(self.data_dir)
+        self.search_index = get_search_index(self.data_dir)
+        self.revisions = RevisionStore(self.data_dir)
 
     def _get_project_path(self, project_id):
         return os.path.join(self.data_dir, project_id)
 
+    def _get_note_path(self, project_id, note_id):
+        return os.path.join(self._get_project_path(project_id), f'{note_id}.md')
+
+    def _get_revision_log(self, project_id, note_id):
+        return os.path.join(self._get_project_path(project_id), '.revisions', f'{note_id}.jsonl')
+
+    def project_lock(self, *project_ids):
+        return project_lock(self.data_dir, *project_ids)
+
     def get_projects(self):
-        projects = []
-        for dir_name in os.listdir(self.data_dir):
-            project_dir = self._get_project_path(dir_name)
-            meta_file = os.path.join(project_dir, 'metadata.json')
-            if os.path.exists(meta_file):
-                with open(meta_file, 'r', encoding='utf-8') as f:
-                    project = json.load(f)
-                    project['created_at'] = str_to_datetime(project['created_at'])
-                    project['updated_at'] = str_to_datetime(project['updated_at'])
-                    projects.append(project)
-        return sorted(projects, key=lambda x: x['created_at'], reverse=True)
+        return [dict(project) for project in self.catalog.list_projects()]
 
     def create_project(self, name):
         project_id = str(uuid.uuid4())
@@ -105,97 +1541,1132 @@ class Storage:
             'notes': [],
             'images': []
         }
-        with open(os.path.join(project_dir, 'metadata.json'), 'w', encoding='utf-8') as f:
-            json.dump(serialize_object(metadata), f, ensure_ascii=False, indent=2)
+        self._save_project_meta(project_id, metadata)
         return metadata
 
     def get_project(self, project_id):
-        project_dir = self._get_project_path(project_id)
-        meta_file = os.path.join(project_dir, 'metadata.json')
-        if not os.path.exists(meta_file):
+        project = self.catalog.load_project(project_id)
+        if project is None:
             return None
-        with open(meta_file, 'r', encoding='utf-8') as f:
-            project = json.load(f)
-            project['created_at'] = str_to_datetime(project['created_at'])
-            project['updated_at'] = str_to_datetime(project['updated_at'])
-            project['notes'] = sorted(project['notes'], key=lambda x: x['created_at'], reverse=True)
-            for note in project['notes']:
-                note['created_at'] = str_to_datetime(note['created_at'])
-                note['updated_at'] = str_to_datetime(note['updated_at'])
-            return project
+        return _copy_project(project)
 
-    def create_note(self, project_id, title):
-        project = self.get_project(project_id)
-        if not project:
+    def has_project(self, project_id):
+        return self.catalog.has_project(project_id)
+
+    def get_project_info(self, project_id):
+        # 只含项目本身的字段，不加载笔记列表
+        return self.catalog.get_project_info(project_id)
+
+    def page_projects(self, sort='created_at', descending=True, cursor=None, limit=30):
+        after = decode_cursor(cursor) if cursor else None
+        return _make_page(self.catalog.page_projects(sort, descending, after, limit), sort, limit)
+
+    def page_notes(self, project_id, sort='created_at', descending=True, cursor=None, limit=30):
+        after = decode_cursor(cursor) if cursor else None
+        items = self.catalog.page_notes(project_id, sort, descending, after, limit)
+        if items is None:
             return None
+        return _make_page(items, sort, limit)
+
+    def get_note_meta(self, project_id, note_id):
+        note_meta = self.catalog.get_note(project_id, note_id)
+        return dict(note_meta) if note_meta else None
+
+    def export_project_meta(self, project_id):
+        # 导出时以 catalog 中的数据为准，保证压缩包里的 metadata.json 与当前后端一致
+        project = self.get_project(project_id)
+        return json.dumps(serialize_object(project), ensure_ascii=False, indent=2) if project else None
+
+    def delete_project(self, project_id):
+        with self.project_lock(project_id):
+            self.catalog.delete_project(project_id)
+            shutil.rmtree(self._get_project_path(project_id), ignore_errors=True)
+        self.search_index.remove_project(project_id)
+
+    def create_note(self, project_id, title):
         note_id = str(uuid.uuid4())
-        note_file = os.path.join(self._get_project_path(project_id), f'{note_id}.md')
+        note_file = self._get_note_path(project_id, note_id)
         initial_content = "# New Note\nStart writing here..."
-        with open(note_file, 'w', encoding='utf-8') as f:
-            f.write(initial_content)
-        note_meta = {
-            'id': note_id,
-            'title': title,
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat(),
-            'hash': compute_hash(initial_content)
-        }
-        project['notes'].append(note_meta)
-        project['updated_at'] = datetime.now().isoformat()
-        self._save_project_meta(project_id, project)
+        with self.project_lock(project_id):
+            if not self.has_project(project_id):
+                return None
+            atomic_write_text(note_file, initial_content)
+            note_meta = {
+                'id': note_id,
+                'title': title,
+                'created_at': datetime.now().isoformat(),
+                'updated_at': datetime.now().isoformat(),
+                'hash': compute_hash(initial_content)
+            }
+            self.catalog.add_note(project_id, note_meta, datetime.now().isoformat())
+            self.search_index.update_note(project_id, note_meta, initial_content)
         return note_meta
 
     def get_note_content(self, project_id, note_id):
-        note_file = os.path.join(self._get_project_path(project_id), f'{note_id}.md')
+        note_file = self._get_note_path(project_id, note_id)
         if not os.path.exists(note_file):
             return None
-        with open(note_file, 'r', encoding='utf-8') as f:
+        with timed('disk'), open(note_file, 'r', encoding='utf-8') as f:
             return f.read()
 
     def update_note(self, project_id, note_id, title, content):
-        project = self.get_project(project_id)
-        if not project:
-            return None
-        note_meta = next((n for n in project['notes'] if n['id'] == note_id), None)
-        if not note_meta:
-            return None
-        note_file = os.path.join(self._get_project_path(project_id), f'{note_id}.md')
-        with open(note_file, 'w', encoding='utf-8') as f:
-            f.write(content)
+        with self.project_lock(project_id):
+            note_meta = self.get_note_meta(project_id, note_id)
+            if not note_meta:
+                return None
+            self._write_note(project_id, note_meta, title, content)
+            self._after_note_saved(project_id, note_meta, content)
+        return note_meta
+
+    def patch_note(self, project_id, note_id, base_hash, edits, title=None):
+        # 仅当磁盘上的内容仍是 base_hash 对应的版本时才应用，否则抛出 NoteConflictError
+        with self.project_lock(project_id):
+            note_meta = self.get_note_meta(project_id, note_id)
+            if not note_meta:
+                return None
+            content = self.get_note_content(project_id, note_id)
+            if note_meta.get('hash') != base_hash or content is None or compute_hash(content) != base_hash:
+                raise NoteConflictError(note_meta.get('hash'))
+            content = apply_text_edits(content, edits)
+            self._write_note(project_id, note_meta, title or note_meta['title'], content)
+            self._after_note_saved(project_id, note_meta, content)
+        return note_meta
+
+    def _write_note(self, project_id, note_meta, title, content):
+        # 调用方需持有项目锁
+        note_meta['hash'] = self._save_note_content(project_id, note_meta, title, content)
         note_meta['title'] = title
         note_meta['updated_at'] = datetime.now().isoformat()
-        note_meta['hash'] = compute_hash(content)
-        project['updated_at'] = datetime.now().isoformat()
-        self._save_project_meta(project_id, project)
+        self.catalog.update_note(project_id, note_meta, datetime.now().isoformat())
+
+    def _save_note_content(self, project_id, note_meta, title, content):
+        # 写入笔记正文并记录版本，返回内容哈希；note_meta 为保存前的元数据，调用方需持有项目锁
+        note_id = note_meta['id']
+        content_hash = compute_hash(content)
+        # 版本记录先于正文写入，且只尽力而为：历史写入失败不能让保存失败，也不能留下已替换正文而元数据未更新的笔记
+        try:
+            if not os.path.exists(self._get_revision_log(project_id, note_id)):
+                # 第一次记录版本时先保存原有内容，之前的版本不会丢失
+                previous = self.get_note_content(project_id, note_id)
+                if previous is not None:
+                    self._record_revision(project_id, note_id, note_meta['title'], previous, compute_hash(previous),
+                                          _isoformat(note_meta['updated_at']))
+            self._record_revision(project_id, note_id, title, content, content_hash)
+        except (OSError, ValueError) as e:
+            print(e)
+        atomic_write_text(self._get_note_path(project_id, note_id), content)
+        return content_hash
+
+    def _record_revision(self, project_id, note_id, title, content, content_hash, saved_at=None):
+        # 内容与最新版本相同时不产生新版本；新内容以上一版本为基准尝试增量存储
+        log_file = self._get_revision_log(project_id, note_id)
+        entries, end = _load_revision_log(log_file)
+        if entries and entries[-1]['hash'] == content_hash:
+            return
+        self.revisions.put(content, content_hash, entries[-1]['hash'] if entries else None)
+        entry = {'hash': content_hash, 'title': title, 'saved_at': saved_at or datetime.now().isoformat(), 'size': len(content)}
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        if len(entries) + 1 > 2 * app.config['REVISION_KEEP_RECENT'] + app.config['REVISION_KEEP_DAYS']:
+            kept = _prune_revisions(entries + [entry], datetime.now())
+            atomic_write_text(log_file, ''.join(json.dumps(e, ensure_ascii=False) + '\n' for e in kept))
+            schedule_revision_gc(self.data_dir, len(entries) + 1 - len(kept))
+        else:
+            with open(log_file, 'ab') as f:
+                # 截掉崩溃时写了一半的最后一行，新记录不会接在残行后面
+                if f.tell() != end:
+                    f.truncate(end)
+                f.write(json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _remove_revision_log(self, project_id, note_id):
+        log_file = self._get_revision_log(project_id, note_id)
+        if os.path.exists(log_file):
+            os.remove(log_file)
+
+    def _move_revision_log(self, project_id, note_id, target_project_id):
+        log_file = self._get_revision_log(project_id, note_id)
+        if os.path.exists(log_file):
+            target_log = self._get_revision_log(target_project_id, note_id)
+            os.makedirs(os.path.dirname(target_log), exist_ok=True)
+            os.replace(log_file, target_log)
+
+    def get_revisions(self, project_id, note_id):
+        # 最新的版本在前
+        if not self.get_note_meta(project_id, note_id):
+            return None
+        return list(reversed(_read_revision_log(self._get_revision_log(project_id, note_id))))
+
+    def get_revision_content(self, project_id, note_id, rev_hash):
+        entries = self.get_revisions(project_id, note_id)
+        if not entries or not any(e['hash'] == rev_hash for e in entries):
+            return None
+        return self.revisions.get(rev_hash)
+
+    def restore_revision(self, project_id, note_id, rev_hash):
+        # 恢复即把旧版本内容作为一次新的保存，当前内容仍保留在历史中
+        content = self.get_revision_content(project_id, note_id, rev_hash)
+        if content is None:
+            return None
+        note_meta = self.get_note_meta(project_id, note_id)
+        return self.update_note(project_id, note_id, note_meta['title'], content)
+
+    def gc_revisions(self):
+        # 按保留策略清理各笔记的版本记录，删除已不存在的笔记的记录，再回收不再被引用的内容对象
+        now = datetime.now()
+        live = set()
+        pruned = 0
+        for project_id in os.listdir(self.data_dir):
+            revision_dir = os.path.join(self._get_project_path(project_id), '.revisions')
+            if project_id.startswith('.') or not os.path.isdir(revision_dir):
+                continue
+            with self.project_lock(project_id):
+                for name in os.listdir(revision_dir):
+                    if not name.endswith('.jsonl'):
+                        continue
+                    log_file = os.path.join(revision_dir, name)
+                    entries = _read_revision_log(log_file)
+                    if self.catalog.get_note(project_id, name[:-len('.jsonl')]) is None:
+                        os.remove(log_file)
+                        pruned += len(entries)
+                        continue
+                    kept = _prune_revisions(entries, now)
+                    if len(kept) < len(entries):
+                        atomic_write_text(log_file, ''.join(json.dumps(e, ensure_ascii=False) + '\n' for e in kept))
+                        pruned += len(entries) - len(kept)
+                    live.update(e['hash'] for e in kept)
+        stats = self.revisions.gc(live)
+        stats['pruned'] = pruned
+        return stats
+
+    def _after_note_saved(self, project_id, note_meta, content):
+        # 调用方需持有项目锁：同一笔记并发保存时按加锁顺序更新索引，较早的内容不会覆盖较新的内容
+        self.search_index.update_note(project_id, note_meta, content)
+        if app.config['PRERENDER_ON_SAVE']:
+            prerender_note_html(content, note_meta['hash'])
+
+    def delete_note(self, project_id, note_id):
+        with self.project_lock(project_id):
+            note_meta = self.catalog.remove_note(project_id, note_id, datetime.now().isoformat())
+            if not note_meta:
+                return None
+            note_file = self._get_note_path(project_id, note_id)
+            if os.path.exists(note_file):
+                os.remove(note_file)
+            self._remove_revision_log(project_id, note_id)
+            self.search_index.remove_note(project_id, note_id)
+        return note_meta
+
+    def move_note(self, project_id, note_id, target_project_id):
+        note_file_source = self._get_note_path(project_id, note_id)
+        note_file_target = self._get_note_path(target_project_id, note_id)
+        with self.project_lock(project_id, target_project_id):
+            os.rename(note_file_source, note_file_target)
+            note_meta = self.catalog.move_note(project_id, note_id, target_project_id, datetime.now().isoformat())
+            if not note_meta:
+                os.rename(note_file_target, note_file_source)
+                return None
+            self._move_revision_log(project_id, note_id, target_project_id)
+            self.search_index.move_note(project_id, note_id, target_project_id)
         return note_meta
 
+    def apply_note_batch(self, project_id, operations):
+        # 按顺序执行一组笔记操作，返回逐条结果；元数据在最后一次性写入
+        # 整个批次持有源项目及所有移动目标项目的锁
+        targets = [op.get('target_project_id') for op in operations if isinstance(op, dict) and op.get('op') == 'move']
+        targets = [t for t in targets if isinstance(t, str) and t != project_id and self.has_project(t)]
+        with self.project_lock(project_id, *targets):
+            return self._apply_note_batch(project_id, operations)
+
+    def _apply_note_batch(self, project_id, operations):
+        project = self.get_project(project_id)
+        if not project:
+            return None
+        original_ids = {n['id'] for n in project['notes']}
+        notes = {n['id']: n for n in project['notes']}
+        touched = []
+        moved = {}
+        indexed = []
+        results = []
+        now = datetime.now().isoformat()
+        # 文件在循环中逐条写入；即使中途出错，已完成的操作也会在 finally 中写入元数据，保持文件与元数据一致
+        try:
+            for index, operation in enumerate(operations):
+                kind = operation.get('op') if isinstance(operation, dict) else None
+                error = _validate_note_operation(operation) if kind else None
+                note_id = operation.get('id') if kind else None
+                if error:
+                    results.append({'index': index, 'op': kind, 'status': 400, 'error': error})
+                elif kind == 'create':
+                    title = operation.get('title') or 'Untitled'
+                    content = operation.get('content')
+                    if content is None:
+                        content = "# New Note\nStart writing here..."
+                    note_id = str(uuid.uuid4())
+                    atomic_write_text(self._get_note_path(project_id, note_id), content)
+                    note_meta = notes[note_id] = {'id': note_id, 'title': title, 'created_at': now, 'updated_at': now, 'hash': compute_hash(content)}
+                    indexed.append((note_meta, content))
+                    results.append({'index': index, 'op': kind, 'status': 201, 'note': note_meta})
+                elif kind in ('update', 'delete', 'move') and note_id not in notes:
+                    results.append({'index': index, 'op': kind, 'status': 404, 'error': 'Note not found'})
+                elif kind == 'update':
+                    title = operation.get('title') or notes[note_id]['title']
+                    content = operation.get('content')
+                    note_meta = notes[note_id]
+                    if content is not None:
+                        note_meta['hash'] = self._save_note_content(project_id, note_meta, title, content)
+                        indexed.append((note_meta, content))
+                    note_meta['title'] = title
+                    note_meta['updated_at'] = now
+                    touched.append(note_id)
+                    results.append({'index': index, 'op': kind, 'status': 200, 'note': note_meta})
+                elif kind == 'delete':
+                    note_meta = notes.pop(note_id)
+                    note_file = self._get_note_path(project_id, note_id)
+                    if os.path.exists(note_file):
+                        os.remove(note_file)
+                    self._remove_revision_log(project_id, note_id)
+                    results.append({'index': index, 'op': kind, 'status': 200, 'id': note_id})
+                elif kind == 'move':
+                    target_project_id = operation.get('target_project_id')
+                    source_file = self._get_note_path(project_id, note_id)
+                    if not target_project_id or target_project_id == project_id or not self.has_project(target_project_id):
+                        results.append({'index': index, 'op': kind, 'status': 404, 'error': 'Target project not found'})
+                        continue
+                    if note_id not in original_ids:
+                        results.append({'index': index, 'op': kind, 'status': 400, 'error': 'Cannot move a note created in the same batch'})
+                        continue
+                    if not os.path.exists(source_file):
+                        results.append({'index': index, 'op': kind, 'status': 404, 'error': 'Note file not found'})
+                        continue
+                    note_meta = notes.pop(note_id)
+                    os.rename(source_file, self._get_note_path(target_project_id, note_id))
+                    note_meta['updated_at'] = now
+                    moved.setdefault(target_project_id, []).append(note_meta)
+                    self._move_revision_log(project_id, note_id, target_project_id)
+                    results.append({'index': index, 'op': kind, 'status': 200, 'id': note_id, 'target_project_id': target_project_id})
+                else:
+                    results.append({'index': index, 'op': kind, 'status': 400, 'error': 'Unknown op'})
+        finally:
+            moved_ids = {n['id'] for notes_moved in moved.values() for n in notes_moved}
+            added = [n for n_id, n in notes.items() if n_id not in original_ids]
+            updated = [notes[n_id] for n_id in dict.fromkeys(touched) if n_id in notes and n_id in original_ids]
+            removed_ids = [n_id for n_id in original_ids if n_id not in notes and n_id not in moved_ids]
+            # 全部操作都失败或被拒绝时不改写元数据，也不更新项目的 updated_at
+            if added or updated or removed_ids or moved:
+                self.catalog.apply_note_changes(project_id, added, updated, removed_ids, moved, now)
+
+            location = {note_id: project_id for note_id in notes}
+            for note_id in removed_ids:
+                self.search_index.remove_note(project_id, note_id)
+            for target_project_id, notes_moved in moved.items():
+                for note_meta in notes_moved:
+                    self.search_index.move_note(project_id, note_meta['id'], target_project_id)
+                    location[note_meta['id']] = target_project_id
+            for note_meta, content in indexed:
+                if note_meta['id'] in location:
+                    self.search_index.update_note(location[note_meta['id']], note_meta, content)
+                    if app.config['PRERENDER_ON_SAVE']:
+                        prerender_note_html(content, note_meta['hash'])
+        return results
+
+    def index_project(self, project_id):
+        # 供导入等批量写入后调用；未变化的笔记按哈希跳过
+        project = self.get_project(project_id)
+        if not project:
+            return
+        for note_meta in project['notes']:
+            content = self.get_note_content(project_id, note_meta['id'])
+            if content is not None:
+                self.search_index.update_note(project_id, note_meta, content)
+
+    def search(self, query, project_id=None, limit=20):
+        self.search_index.ensure_loaded(self)
+        return self.search_index.search(query, project_id=project_id, limit=limit)
+
     def _save_project_meta(self, project_id, metadata):
-        meta_file = os.path.join(self._get_project_path(project_id), 'metadata.json')
-        with open(meta_file, 'w', encoding='utf-8') as f:
-            json.dump(serialize_object(metadata), f, ensure_ascii=False, indent=2)
+        with self.project_lock(project_id):
+            self.catalog.save_project(project_id, metadata)
+
+MARKDOWN_EXTENSIONS = ['extra']
+
+# 每个线程复用一个预先加载好扩展的 Markdown 实例，避免每次渲染都重新构建
+_markdown_local = threading.local()
+
+def _get_markdown_converter():
+    converter = getattr(_markdown_local, 'converter', None)
+    if converter is None:
+        import markdown
+        converter = _markdown_local.converter = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+    return converter
 
 def render_markdown_with_bootstrap(md_content):
-    html = markdown.markdown(md_content, extensions=['extra'])
-    container = div(_class="card")
-    card_body = div(_class="card-body")
-    card_body.add(raw(html))
-    container.add(card_body)
-    return str(container)
+    from dominate.tags import div
+    from dominate.util import raw
+    with timed('markdown'):
+        converter = _get_markdown_converter()
+        try:
+            html = converter.convert(md_content)
+        finally:
+            # 清除脚注、缩写等扩展在上一次转换中留下的状态
+            converter.reset()
+        container = div(_class="card")
+        card_body = div(_class="card-body")
+        card_body.add(raw(html))
+        container.add(card_body)
+        return str(container)
+
+# 渲染配置变化（Markdown 版本、扩展、外层结构）时缓存键随之变化，旧缓存自然失效
+_renderer_version = None
+
+def renderer_version():
+    global _renderer_version
+    if _renderer_version is None:
+        import markdown
+        _renderer_version = compute_hash(f"{markdown.__version__}|{','.join(MARKDOWN_EXTENSIONS)}|bootstrap-card")[:16]
+    return _renderer_version
+
+# 渲染结果缓存：以笔记内容哈希 + 渲染配置为键，内存 LRU，可选磁盘二级缓存
+class RenderCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _disk_path(self, key):
+        cache_dir = app.config['RENDER_CACHE_DIR']
+        if not cache_dir:
+            return None
+        return os.path.join(cache_dir, key[:2], f'{key}.html')
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return html
+        disk_path = self._disk_path(key)
+        if disk_path and os.path.exists(disk_path):
+            with timed('disk'), open(disk_path, 'r', encoding='utf-8') as f:
+                html = f.read()
+            self._remember(key, html)
+            with self._lock:
+                self.hits += 1
+            return html
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > app.config['RENDER_CACHE_SIZE']:
+                self._entries.popitem(last=False)
+
+    def put(self, key, html):
+        self._remember(key, html)
+        disk_path = self._disk_path(key)
+        if disk_path and not os.path.exists(disk_path):
+            os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+            tmp_path = f'{disk_path}.{uuid.uuid4().hex}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(html)
+            os.replace(tmp_path, disk_path)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'entries': len(self._entries)
+            }
+
+render_cache = RenderCache()
+_prerender_executor = ThreadPoolExecutor(max_workers=1)
+
+# 导出渲染与完整性检查共用的进程池，按进程数各创建一个并在整个服务进程内复用。
+# 服务进程里有多个线程，fork 出的子进程可能继承其他线程持有的锁，因此用 forkserver（不支持时用 spawn）启动工作进程
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+def get_process_pool(processes):
+    with _process_pools_lock:
+        pool = _process_pools.get(processes)
+        if pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            pool = _process_pools[processes] = ProcessPoolExecutor(max_workers=processes,
+                                                                   mp_context=multiprocessing.get_context(method))
+        return pool
+
+def map_in_process_pool(func, items, processes, chunksize=1):
+    # 工作进程异常退出（例如内存不足被终止）后进程池不能再用，丢弃缓存的池，下次调用时重新创建
+    from concurrent.futures.process import BrokenProcessPool
+    pool = get_process_pool(processes)
+    try:
+        return list(pool.map(func, items, chunksize=chunksize))
+    except BrokenProcessPool:
+        with _process_pools_lock:
+            if _process_pools.get(processes) is pool:
+                del _process_pools[processes]
+        pool.shutdown(wait=False)
+        raise
+
+def render_markdown_batch(md_contents, processes=None):
+    # 默认在当前线程顺序渲染，复用同一个转换器；processes > 1 时交给共用的进程池并行
+    md_contents = list(md_contents)
+    if not processes or processes < 2 or len(md_contents) < 2:
+        return [render_markdown_with_bootstrap(content) for content in md_contents]
+    chunksize = max(1, len(md_contents) // (processes * 4))
+    return map_in_process_pool(render_markdown_with_bootstrap, md_contents, processes, chunksize)
+
+def render_notes_html(notes, processes=None):
+    # notes 为 [(md_content, content_hash), ...]，已缓存的直接返回，其余批量渲染后写入缓存
+    results = []
+    missing = []
+    for md_content, content_hash in notes:
+        key = f"{content_hash or compute_hash(md_content)}-{renderer_version()}"
+        html = render_cache.get(key)
+        if html is None:
+            missing.append((len(results), key, md_content))
+        results.append(html)
+    rendered = render_markdown_batch([item[2] for item in missing], processes=processes)
+    for (position, key, _), html in zip(missing, rendered):
+        render_cache.put(key, html)
+        results[position] = html
+    return results
+
+def render_note_html(md_content, content_hash=None):
+    key = f"{content_hash or compute_hash(md_content)}-{renderer_version()}"
+    html = render_cache.get(key)
+    if html is None:
+        html = render_markdown_with_bootstrap(md_content)
+        render_cache.put(key, html)
+    return html
+
+def prerender_note_html(md_content, content_hash):
+    _prerender_executor.submit(render_note_html, md_content, content_hash)
+
+# ---------------------- 流式 ZIP ----------------------
+# 本身已压缩的格式直接存储，避免重复压缩浪费 CPU
+_COMPRESSED_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.zip', '.gz', '.bz2', '.xz',
+    '.7z', '.rar', '.mp3', '.mp4', '.m4a', '.webm', '.pdf', '.woff', '.woff2'
+}
+# 导出项目时不打包的文件：metadata.json 由当前存储后端单独生成，journal.jsonl 中的变更已包含在其中；
+# 版本历史（.revisions 目录）依赖全局的内容对象，不随项目导出
+_EXPORT_EXCLUDED = {'metadata.json', 'journal.jsonl', '.revisions'}
+
+class _ZipStreamWriter:
+    # 交给 ZipFile 的不可 seek 输出流，写入的数据由生成器分块取走
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip(entries, store_compressed=True, chunk_size=64 * 1024):
+    # entries 为 (arcname, 文件路径或 bytes) 序列；逐块产出压缩数据，内存占用与项目大小无关
+    import zipfile
+    writer = _ZipStreamWriter()
+    with zipfile.ZipFile(writer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for arcname, source in entries:
+            stored = store_compressed and os.path.splitext(arcname)[1].lower() in _COMPRESSED_EXTENSIONS
+            compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            if isinstance(source, bytes):
+                info = zipfile.ZipInfo(arcname, date_time=datetime.now().timetuple()[:6])
+                info.compress_type = compress_type
+                zf.writestr(info, source)
+            else:
+                info = zipfile.ZipInfo.from_file(source, arcname)
+                info.compress_type = compress_type
+                with open(source, 'rb') as src, zf.open(info, 'w') as dest:
+                    while True:
+                        chunk = src.read(chunk_size)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        data = writer.take()
+                        if data:
+                            yield data
+            data = writer.take()
+            if data:
+                yield data
+    yield writer.take()
+
+def iter_project_zip_entries(storage, project_id):
+    meta_json = storage.export_project_meta(project_id)
+    project_path = storage._get_project_path(project_id)
+    for root, dirs, files in os.walk(project_path):
+        dirs[:] = [d for d in dirs if d not in _EXPORT_EXCLUDED]
+        for name in files:
+            file_path = os.path.join(root, name)
+            arcname = os.path.relpath(file_path, project_path).replace(os.sep, '/')
+            if arcname not in _EXPORT_EXCLUDED:
+                yield arcname, file_path
+    yield 'metadata.json', meta_json.encode('utf-8')
+
+def set_attachment_headers(response, download_name):
+    # 与 send_file 相同的处理方式，非 ASCII 文件名使用 RFC 5987 编码
+    try:
+        download_name.encode('ascii')
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        quoted = quote(download_name, safe="!#$&+^`|~")
+        response.headers.set('Content-Disposition', 'attachment', filename=simple, **{'filename*': f"UTF-8''{quoted}"})
+    return response
+
+# ---------------------- 网页导出 ----------------------
+# 按预览的渲染方式把项目（或选中的笔记）导出为静态网页或单个 HTML 文档，边渲染边以 ZIP 流式输出。
+# 内容哈希未变的笔记直接使用渲染缓存，其余按批交给进程池渲染；引用的上传图片一并打包到 assets/ 下
+EXPORT_FORMATS = ('site', 'document')
+_UPLOAD_URL_RE = re.compile(r'''(?:https?://[^/"'\s()<>]+)?/static/uploads/([^"'\s()<>?#]+)''')
+_export_lock = threading.Lock()
+_active_exports = 0
+
+def _localize_upload_urls(html, prefix, assets):
+    # 把指向本站上传目录的图片地址改为压缩包内的相对路径，并记录需要打包的文件
+    upload_root = os.path.join(app.root_path, 'static', 'uploads')
+
+    def replace(match):
+        path = safe_join(upload_root, match.group(1))
+        if path is None or not os.path.isfile(path):
+            return match.group(0)
+        arcname = f'assets/{match.group(1)}'
+        assets[arcname] = path
+        return prefix + arcname
+
+    return _UPLOAD_URL_RE.sub(replace, html)
+
+def iter_rendered_notes(storage, project_id, notes, processes=None):
+    # 逐条产出 (note_meta, html)，每批 EXPORT_BATCH_SIZE 条；笔记文件缺失时跳过
+    batch_size = app.config['EXPORT_BATCH_SIZE']
+    for start in range(0, len(notes), batch_size):
+        batch = []
+        for note_meta in notes[start:start + batch_size]:
+            content = storage.get_note_content(project_id, note_meta['id'])
+            if content is not None:
+                batch.append((note_meta, content))
+        rendered = render_notes_html([(content, compute_hash(content)) for _, content in batch], processes=processes)
+        for (note_meta, _), html in zip(batch, rendered):
+            yield note_meta, html
+
+def iter_export_entries(storage, project, notes, export_format, processes=None):
+    # 产出 stream_zip 所需的 (arcname, 文件路径或 bytes)
+    assets = {}
+    exported_at = datetime.now()
+    rendered = iter_rendered_notes(storage, project['id'], notes, processes)
+    if export_format == 'site':
+        exported = []
+        for note_meta, html in rendered:
+            page = render_template('export/note.html', project=project, note=note_meta,
+                                   content=_localize_upload_urls(html, '../', assets))
+            exported.append(note_meta)
+            yield f"notes/{note_meta['id']}.html", page.encode('utf-8')
+        page = render_template('export/index.html', project=project, notes=exported, exported_at=exported_at)
+        yield 'index.html', page.encode('utf-8')
+    else:
+        # 单个文档可能很大，边渲染边写入临时文件，再作为一个条目打包
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            document_path = os.path.join(tmp_dir, 'document.html')
+            sections = ((note_meta, _localize_upload_urls(html, '', assets)) for note_meta, html in rendered)
+            template = app.jinja_env.get_template('export/document.html')
+            with open(document_path, 'w', encoding='utf-8') as f:
+                for chunk in template.generate(project=project, notes=notes, sections=sections, exported_at=exported_at):
+                    f.write(chunk)
+            yield 'document.html', document_path
+    for arcname, path in sorted(assets.items()):
+        yield arcname, path
+
+def _finish_export():
+    global _active_exports
+    with _export_lock:
+        _active_exports -= 1
+
+# ---------------------- 项目导入 ----------------------
+class ArchiveImportError(Exception):
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.message = message
+        self.details = details
+
+def _safe_extract_path(project_dir, name):
+    # 拒绝绝对路径、盘符与 .. 等越出项目目录的条目
+    normalized = name.replace('\\', '/')
+    parts = [part for part in normalized.split('/') if part not in ('', '.')]
+    if normalized.startswith('/') or not parts or '..' in parts or ':' in parts[0]:
+        raise ArchiveImportError('导入项目失败，压缩包包含非法路径', name)
+    return os.path.join(project_dir, *parts)
+
+def _extract_archive(zf, project_dir, chunk_size=64 * 1024):
+    infos = zf.infolist()
+    if len(infos) > app.config['IMPORT_MAX_ENTRIES']:
+        raise ArchiveImportError('导入项目失败，压缩包文件数量超出限制', f'{len(infos)} entries')
+    max_total = app.config['IMPORT_MAX_UNCOMPRESSED_SIZE']
+    if sum(info.file_size for info in infos) > max_total:
+        raise ArchiveImportError('导入项目失败，解压后大小超出限制')
+    total = 0
+    for info in infos:
+        target = _safe_extract_path(project_dir, info.filename)
+        if info.is_dir():
+            os.makedirs(target, exist_ok=True)
+            continue
+        if info.file_size > app.config['IMPORT_MAX_RATIO'] * max(info.compress_size, 1):
+            raise ArchiveImportError('导入项目失败，压缩比异常', info.filename)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        written = 0
+        # 按实际解压出的字节计数，不信任条目头中声明的大小
+        with zf.open(info) as src, open(target, 'wb') as dest:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                total += len(chunk)
+                if written > info.file_size or total > max_total:
+                    raise ArchiveImportError('导入项目失败，解压后大小超出限制', info.filename)
+                dest.write(chunk)
+
+def _rebuild_note_hashes(storage, project_id, notes):
+    # 并行读取并重新计算笔记哈希，缺少 .md 文件的笔记会被丢弃
+    def rebuild(note):
+        content = storage.get_note_content(project_id, note['id'])
+        return None if content is None else compute_hash(content)
+    with ThreadPoolExecutor(max_workers=app.config['IMPORT_HASH_WORKERS']) as pool:
+        hashes = list(pool.map(rebuild, notes))
+    kept = []
+    for note, note_hash in zip(notes, hashes):
+        if note_hash is not None:
+            note['hash'] = note_hash
+            kept.append(note)
+    return kept
+
+def import_project_archive(storage, fileobj):
+    import zipfile
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    if size > app.config['IMPORT_MAX_ARCHIVE_SIZE']:
+        raise ArchiveImportError('导入项目失败，压缩包超出大小限制', f'{size} bytes')
+    try:
+        zf = zipfile.ZipFile(fileobj, 'r')
+    except zipfile.BadZipFile as e:
+        raise ArchiveImportError('解压项目失败', str(e))
+
+    new_project_id = str(uuid.uuid4())
+    project_dir = storage._get_project_path(new_project_id)
+    os.makedirs(project_dir, exist_ok=True)
+    try:
+        with zf:
+            try:
+                _extract_archive(zf, project_dir)
+            except (zipfile.BadZipFile, zipfile.LargeZipFile, RuntimeError, NotImplementedError, zlib.error) as e:
+                raise ArchiveImportError('解压项目失败', str(e))
+        metadata_path = os.path.join(project_dir, 'metadata.json')
+        if not os.path.exists(metadata_path):
+            raise ArchiveImportError('导入项目失败，未找到 metadata.json')
+        try:
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            notes = [note for note in meta.get('notes', [])
+                     if os.path.basename(str(note['id'])) == note['id'] and note['title']]
+            for note in notes:
+                str_to_datetime(note['created_at'])
+                str_to_datetime(note['updated_at'])
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise ArchiveImportError('导入项目失败，metadata.json 格式错误', str(e))
+        meta['id'] = new_project_id
+        meta['name'] = meta.get('name') or new_project_id
+        meta['created_at'] = datetime.now().isoformat()
+        meta['updated_at'] = datetime.now().isoformat()
+        meta['notes'] = _rebuild_note_hashes(storage, new_project_id, notes)
+        storage._save_project_meta(new_project_id, meta)
+    except BaseException:
+        shutil.rmtree(project_dir, ignore_errors=True)
+        raise
+    storage.index_project(new_project_id)
+    return meta
+
+# ---------------------- 完整性检查 ----------------------
+# 遍历 DATA_DIR 下的全部项目，重新计算笔记哈希并与元数据比对，同时查找孤立文件与缺失文件。
+# 上次检查的 (mtime, size, hash) 记录在 DATA_DIR/.scrub_state.json，未变化的文件不再重新计算
+SCRUB_BATCH_SIZE = 256
+
+def _hash_note_file(path):
+    # 在子进程中执行，需为模块级函数；与 get_note_content + compute_hash 的结果一致
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return compute_hash(f.read()), None
+    except (OSError, UnicodeDecodeError) as e:
+        return None, str(e)
+
+def _recheck_note(storage, project_id, note_id):
+    # 在项目锁内复查，排除检查期间笔记恰好被保存造成的误报；一致时返回 None
+    with storage.project_lock(project_id):
+        note_meta = storage.get_note_meta(project_id, note_id)
+        content = storage.get_note_content(project_id, note_id)
+        if note_meta is None or content is None:
+            return None
+        current_hash = compute_hash(content)
+        return None if current_hash == note_meta.get('hash') else (note_meta.get('hash'), current_hash)
+
+def _find_orphaned_uploads(upload_root, images, grace_seconds=3600):
+    # 图片登记中未引用的上传文件；已登记图片的缩略图与最近的上传临时文件不算
+    referenced = set()
+    for image in images:
+        static_part = image['url'].split('/static/uploads/', 1)
+        if len(static_part) == 2:
+            original = os.path.normpath(os.path.join(upload_root, static_part[1]))
+            referenced.add(original)
+            referenced.add(thumbnail_path(original))
+    orphaned = []
+    deadline = time.time() - grace_seconds
+    for root, _, files in os.walk(upload_root):
+        for name in files:
+            path = os.path.normpath(os.path.join(root, name))
+            if path in referenced or (name.endswith('.part') and os.path.getmtime(path) > deadline):
+                continue
+            orphaned.append(os.path.relpath(path, upload_root).replace(os.sep, '/'))
+    return sorted(orphaned)
+
+def scrub_data_dir(data_dir=None, full=False, processes=None, max_bytes_per_sec=None):
+    # 返回可直接序列化为 JSON 的报告；full=True 时忽略上次的记录全部重新计算
+    storage = Storage(data_dir)
+    state_file = os.path.join(storage.data_dir, '.scrub_state.json')
+    previous = {}
+    if not full and os.path.exists(state_file):
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            previous = {}
+    started = time.time()
+    report = {
+        'data_dir': storage.data_dir,
+        'started_at': datetime.now().isoformat(),
+        'projects': 0, 'notes': 0, 'hashed': 0, 'skipped': 0, 'bytes_hashed': 0,
+        'mismatches': [], 'missing_files': [], 'unreadable_files': [],
+        'orphaned_notes': [], 'orphaned_project_dirs': [], 'orphaned_uploads': []
+    }
+    state = {}
+    pending = []
+    projects = storage.get_projects()
+    for project_info in projects:
+        project_id = project_info['id']
+        # SQLite 后端的项目列表不含笔记，逐个加载完整的项目；列出后被删除的项目直接跳过
+        project = storage.get_project(project_id)
+        if project is None:
+            continue
+        report['projects'] += 1
+        note_ids = set()
+        for note_meta in project['notes']:
+            note_id = note_meta['id']
+            note_ids.add(note_id)
+            report['notes'] += 1
+            path = storage._get_note_path(project_id, note_id)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                report['missing_files'].append({'project_id': project_id, 'note_id': note_id})
+                continue
+            key = f'{project_id}/{note_id}'
+            item = {'key': key, 'path': path, 'project_id': project_id, 'note_id': note_id,
+                    'expected': note_meta.get('hash'), 'stamp': [st.st_mtime_ns, st.st_size]}
+            cached = previous.get(key)
+            if cached and cached[:2] == item['stamp']:
+                report['skipped'] += 1
+                _scrub_compare(storage, report, state, item, cached[2])
+            else:
+                pending.append(item)
+        project_dir = storage._get_project_path(project_id)
+        if os.path.isdir(project_dir):
+            for name in os.listdir(project_dir):
+                if name.endswith('.md') and name[:-3] not in note_ids:
+                    report['orphaned_notes'].append({'project_id': project_id, 'file': name})
+
+    known = {project['id'] for project in projects}
+    for name in os.listdir(storage.data_dir):
+        if not name.startswith('.') and name not in known and os.path.isdir(os.path.join(storage.data_dir, name)):
+            report['orphaned_project_dirs'].append(name)
+
+    # 分批计算哈希；设置了速率上限时每批之后按已读取的字节数休眠
+    processes = processes or os.cpu_count() or 1
+    use_pool = processes > 1 and len(pending) > SCRUB_BATCH_SIZE
+    hashing_started = time.time()
+    for start in range(0, len(pending), SCRUB_BATCH_SIZE):
+        batch = pending[start:start + SCRUB_BATCH_SIZE]
+        paths = [item['path'] for item in batch]
+        if use_pool:
+            results = map_in_process_pool(_hash_note_file, paths, processes, max(1, len(paths) // processes))
+        else:
+            results = map(_hash_note_file, paths)
+        for item, (actual, error) in zip(batch, results):
+            report['hashed'] += 1
+            report['bytes_hashed'] += item['stamp'][1]
+            if error is not None:
+                report['unreadable_files'].append({'project_id': item['project_id'], 'note_id': item['note_id'], 'error': error})
+                continue
+            _scrub_compare(storage, report, state, item, actual)
+        if max_bytes_per_sec:
+            delay = report['bytes_hashed'] / max_bytes_per_sec - (time.time() - hashing_started)
+            if delay > 0:
+                time.sleep(delay)
+
+    upload_root = os.path.join(app.root_path, 'static', 'uploads')
+    if os.path.isdir(upload_root):
+        # 按传入的数据目录读取图片登记，检查其他数据目录时不会误用默认 DATA_DIR 的登记
+        image_storage = ImageStorage(os.path.join(storage.data_dir, 'images.json'))
+        report['orphaned_uploads'] = _find_orphaned_uploads(upload_root, image_storage.get_all_images())
+
+    atomic_write_json(state_file, state)
+    report['finished_at'] = datetime.now().isoformat()
+    report['duration'] = round(time.time() - started, 3)
+    report['ok'] = not any(report[k] for k in ('mismatches', 'missing_files', 'unreadable_files', 'orphaned_notes',
+                                                'orphaned_project_dirs', 'orphaned_uploads'))
+    return report
+
+def _scrub_compare(storage, report, state, item, actual):
+    state[item['key']] = item['stamp'] + [actual]
+    if actual == item['expected']:
+        return
+    mismatch = _recheck_note(storage, item['project_id'], item['note_id'])
+    if mismatch is not None:
+        report['mismatches'].append({'project_id': item['project_id'], 'note_id': item['note_id'],
+                                     'expected': mismatch[0], 'actual': mismatch[1]})
+    # 文件在检查期间被修改过，记录的哈希已过期
+    state.pop(item['key'], None)
+
+# 后台检查任务：同一时间只运行一个，两次启动之间至少间隔 SCRUB_MIN_INTERVAL 秒，报告保存在 DATA_DIR/.scrub_report.json
+_scrub_lock = threading.Lock()
+_scrub_job = {'running': False, 'last_started': 0.0, 'error': None}
+
+def start_background_scrub(data_dir):
+    # 返回 (是否已启动, 需等待的秒数)
+    with _scrub_lock:
+        if _scrub_job['running']:
+            return False, 0
+        wait = _scrub_job['last_started'] + app.config['SCRUB_MIN_INTERVAL'] - time.time()
+        if wait > 0:
+            return False, math.ceil(wait)
+        _scrub_job.update(running=True, last_started=time.time(), error=None)
+    threading.Thread(target=_run_background_scrub, args=(data_dir,), daemon=True).start()
+    return True, 0
+
+def _run_background_scrub(data_dir):
+    try:
+        report = scrub_data_dir(data_dir, processes=app.config['SCRUB_PROCESSES'],
+                                max_bytes_per_sec=app.config['SCRUB_MAX_BYTES_PER_SEC'])
+        atomic_write_json(os.path.join(data_dir, '.scrub_report.json'), report, ensure_ascii=False, indent=2)
+    except Exception as e:
+        _scrub_job['error'] = str(e)
+    finally:
+        with _scrub_lock:
+            _scrub_job['running'] = False
+
+def load_scrub_report(data_dir):
+    try:
+        with open(os.path.join(data_dir, '.scrub_report.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# ---------------------- 请求指标 ----------------------
+# 每个请求内按阶段累计耗时（JSON 解析、磁盘读写、Markdown 渲染、模板渲染），请求结束时计入直方图并写入 Server-Timing 头。
+# 指标保存在进程内，多进程部署时每个进程各自统计
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PHASES = ('json', 'disk', 'markdown', 'template')
+
+def _metric_labels(names, values):
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=METRIC_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}   # 标签值 -> [各桶计数..., 总和, 次数]，桶计数不累加，输出时再累加
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series_items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in series_items:
+            label_text = _metric_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{label_text}}} {series[-1]}')
+        return lines
+
+request_histogram = Histogram('mns_request_duration_seconds', 'Request latency by route.', ('method', 'route', 'status'))
+phase_histogram = Histogram('mns_request_phase_seconds', 'Time spent in each phase of a request.', ('route', 'phase'))
+
+@contextmanager
+def timed(phase):
+    # 请求之外（后台线程、进程池、命令行）调用时不计时
+    timings = g.get('timings') if has_request_context() else None
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - started
+
+# 请求体解析与 jsonify 都经过 app.json，在这里统计 JSON 耗时
+class TimedJSONProvider(DefaultJSONProvider):
+    def loads(self, s, **kwargs):
+        with timed('json'):
+            return super().loads(s, **kwargs)
+
+    def dumps(self, obj, **kwargs):
+        with timed('json'):
+            return super().dumps(obj, **kwargs)
+
+app.json = TimedJSONProvider(app)
+
+def _template_started(sender, template, context, **extra):
+    if has_request_context() and g.get('timings') is not None:
+        g.template_started = time.perf_counter()
+
+def _template_finished(sender, template, context, **extra):
+    started = g.pop('template_started', None) if has_request_context() else None
+    if started is not None:
+        g.timings['template'] = g.timings.get('template', 0.0) + time.perf_counter() - started
+
+before_render_template.connect(_template_started, app)
+template_rendered.connect(_template_finished, app)
+
+# 采样分析：对正在处理请求的线程，按固定间隔抓取调用栈并计数；慢请求结束时把栈写成 collapsed 格式
+# （每行 "根;...;叶 次数"），可直接交给 flamegraph.pl 或 speedscope 生成火焰图
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stacks = {}   # 线程 ident -> {collapsed 栈: 采样次数}
+        self._thread = None
+
+    def start(self, ident):
+        with self._lock:
+            self._stacks[ident] = {}
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+
+    def stop(self, ident):
+        with self._lock:
+            return self._stacks.pop(ident, None)
+
+    def _run(self):
+        while True:
+            time.sleep(app.config['PROFILE_SAMPLE_INTERVAL'])
+            with self._lock:
+                if not self._stacks:
+                    continue
+                frames = sys._current_frames()
+                for ident, counts in self._stacks.items():
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None:
+                        stack.append(f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}')
+                        frame = frame.f_back
+                    if stack:
+                        key = ';'.join(reversed(stack))
+                        counts[key] = counts.get(key, 0) + 1
+
+profiler = SamplingProfiler()
+
+def _profile_dir():
+    return app.config['PROFILE_DIR'] or os.path.join(app.config['DATA_DIR'], '.profiles')
+
+def _write_profile(route, duration, counts):
+    profile_dir = _profile_dir()
+    os.makedirs(profile_dir, exist_ok=True)
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+    filename = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{request.method}-{slug}-{int(duration * 1000)}ms.folded"
+    atomic_write_text(os.path.join(profile_dir, filename), ''.join(f'{stack} {count}\n' for stack, count in sorted(counts.items())))
+    # 只保留最新的 PROFILE_KEEP 个文件
+    profiles = sorted(name for name in os.listdir(profile_dir) if name.endswith('.folded'))
+    for name in profiles[:max(0, len(profiles) - app.config['PROFILE_KEEP'])]:
+        try:
+            os.remove(os.path.join(profile_dir, name))
+        except FileNotFoundError:
+            pass
+
+def render_metrics():
+    lines = request_histogram.render() + phase_histogram.render()
+    caches = {'metadata': metadata_cache.stats(), 'render': render_cache.stats()}
+    for metric, key, kind, help_text in (('mns_cache_hits_total', 'hits', 'counter', 'Cache hits.'),
+                                         ('mns_cache_misses_total', 'misses', 'counter', 'Cache misses.'),
+                                         ('mns_cache_hit_ratio', 'hit_ratio', 'gauge', 'Cache hit ratio since start.')):
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}']
+        lines += [f'{metric}{{cache="{name}"}} {stats[key]}' for name, stats in caches.items()]
+    return '\n'.join(lines) + '\n'
+
+@app.before_request
+def start_request_metrics():
+    if not app.config['METRICS_ENABLED']:
+        return
+    g.request_started = time.perf_counter()
+    g.timings = {}
+    if app.config['PROFILE_SLOW_REQUESTS'] is not None:
+        profiler.start(threading.get_ident())
+        g.profiling = True
+
+@app.teardown_request
+def stop_request_profiler(exc):
+    # 视图抛出异常时 after_request 不会执行，在这里保证线程被移出采样列表
+    if g.pop('profiling', False):
+        profiler.stop(threading.get_ident())
 
 # ---------------------- 基本页面路由 ----------------------
 @app.route('/')
 def index():
     storage = Storage()
-    projects = storage.get_projects()
-    return render_template('index.html', projects=projects)
+    page = storage.page_projects(limit=app.config['PAGE_SIZE'])
+    return render_template('index.html', projects=page['items'], next_cursor=page['next_cursor'])
 
 @app.route('/projects/<project_id>')
 def project_detail(project_id):
     storage = Storage()
-    project = storage.get_project(project_id)
+    project = storage.get_project_info(project_id)
     if not project:
         abort(404)
-    return render_template('project_detail.html', project=project)
+    page = storage.page_notes(project_id, limit=app.config['PAGE_SIZE'])
+    return render_template('project_detail.html', project=project, notes=page['items'], next_cursor=page['next_cursor'])
 
 @app.route('/projects/<project_id>/notes/<note_id>/edit')
 def note_edit(project_id, note_id):
@@ -217,12 +2688,74 @@ def note_preview(project_id, note_id):
     if not note_meta:
         abort(404)
     md_content = storage.get_note_content(project_id, note_id)
-    bootstrap_html = render_markdown_with_bootstrap(md_content)
-    return render_template('note_preview.html', project=project, note=note_meta, content=bootstrap_html)
+    if md_content is None:
+        abort(404)
+    # 以实际文件内容计算哈希，文件被外部修改时不会命中旧的渲染结果
+    content_hash = compute_hash(md_content)
+    template_stamps = [_file_stamp(os.path.join(app.root_path, 'templates', name)) for name in ('base.html', 'note_preview.html')]
+    etag = compute_hash(f"{project_id}|{note_id}|{note_meta['title']}|{content_hash}|{renderer_version()}|{template_stamps}")
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        bootstrap_html = render_note_html(md_content, content_hash)
+        response = app.make_response(render_template('note_preview.html', project=project, note=note_meta, content=bootstrap_html))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 # ---------------------- API 接口 ----------------------
 # 以下按照 URL 前缀分组
 
+# ----- 分页列表接口 -----
+def _page_args():
+    # 解析 sort / order / cursor / limit 参数，非法时抛出 ValueError
+    sort = request.args.get('sort', 'created_at')
+    order = request.args.get('order', 'desc')
+    if sort not in PAGE_SORTS or order not in ('asc', 'desc'):
+        raise ValueError('Invalid sort or order')
+    limit = request.args.get('limit', app.config['PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['PAGE_SIZE_MAX']))
+    cursor = request.args.get('cursor') or None
+    if cursor:
+        decode_cursor(cursor)
+    return {'sort': sort, 'descending': order == 'desc', 'cursor': cursor, 'limit': limit}
+
+def _with_thumb_url(img):
+    upload_part = img['url'].split('/static/uploads/', 1)
+    thumb_url = url_for('image_thumbnail', filename=upload_part[1]) if len(upload_part) == 2 else img['url']
+    return {**img, 'thumb_url': thumb_url}
+
+@app.route('/api/projects', methods=['GET'])
+def list_projects():
+    try:
+        args = _page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    page = Storage().page_projects(**args)
+    page['items'] = [{k: v for k, v in p.items() if k != 'notes'} for p in page['items']]
+    return jsonify(serialize_object(page)), 200
+
+@app.route('/api/projects/<project_id>/notes', methods=['GET'])
+def list_notes(project_id):
+    try:
+        args = _page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    page = Storage().page_notes(project_id, **args)
+    if page is None:
+        return jsonify({'error': 'Project not found'}), 404
+    return jsonify(serialize_object(page)), 200
+
+@app.route('/api/images', methods=['GET'])
+def list_images():
+    try:
+        args = _page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    page = ImageStorage().page_images(descending=args['descending'], cursor=args['cursor'], limit=args['limit'])
+    page['items'] = [_with_thumb_url(img) for img in page['items']]
+    return jsonify(page), 200
+
 # ----- Project 相关接口 -----
 @app.route('/api/projects', methods=['POST'])
 def create_project():
@@ -239,8 +2772,7 @@ def delete_project(project_id):
     project = storage.get_project(project_id)
     if not project:
         return jsonify({'error': 'Project not found'}), 404
-    project_dir = storage._get_project_path(project_id)
-    shutil.rmtree(project_dir)
+    storage.delete_project(project_id)
     return jsonify({'message': 'Project deleted'}), 200
 
 @app.route('/api/projects/import', methods=['POST'])
@@ -251,57 +2783,80 @@ def import_project():
     if file.filename == '':
         return jsonify({'error': '未选择文件'}), 400
 
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-    file.save(temp_file.name)
-    temp_file.close()
-
     storage = Storage()
-    new_project_id = str(uuid.uuid4())
-    project_dir = storage._get_project_path(new_project_id)
-    os.makedirs(project_dir, exist_ok=True)
-
     try:
-        with zipfile.ZipFile(temp_file.name, 'r') as zip_ref:
-            zip_ref.extractall(project_dir)
-    except Exception as e:
-        os.unlink(temp_file.name)
-        return jsonify({'error': '解压项目失败', 'details': str(e)}), 400
-
-    os.unlink(temp_file.name)
-    metadata_path = os.path.join(project_dir, 'metadata.json')
-    if os.path.exists(metadata_path):
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            meta = json.load(f)
-        meta['id'] = new_project_id
-        meta['created_at'] = datetime.now().isoformat()
-        meta['updated_at'] = datetime.now().isoformat()
-    else:
-        shutil.rmtree(project_dir)
-        return jsonify({'error': '导入项目失败，未找到 metadata.json'}), 400
-    with open(metadata_path, 'w', encoding='utf-8') as f:
-        json.dump(serialize_object(meta), f, ensure_ascii=False, indent=2)
+        meta = import_project_archive(storage, file.stream)
+    except ArchiveImportError as e:
+        return jsonify({'error': e.message, 'details': e.details}), 400
     return jsonify(meta), 201
 
+@app.route('/api/projects/import_bulk', methods=['POST'])
+def import_projects_bulk():
+    files = [f for f in request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({'error': '未选择文件'}), 400
+
+    # 以 NDJSON 逐行返回每个压缩包的进度与结果
+    def generate():
+        storage = Storage()
+        imported = 0
+        for index, file in enumerate(files):
+            yield json.dumps({'index': index, 'filename': file.filename, 'status': 'started'}, ensure_ascii=False) + '\n'
+            try:
+                meta = import_project_archive(storage, file.stream)
+            except ArchiveImportError as e:
+                result = {'index': index, 'filename': file.filename, 'status': 'error', 'error': e.message, 'details': e.details}
+            else:
+                imported += 1
+                result = {'index': index, 'filename': file.filename, 'status': 'done',
+                          'project': {'id': meta['id'], 'name': meta['name'], 'notes': len(meta['notes'])}}
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+        yield json.dumps({'status': 'finished', 'imported': imported, 'failed': len(files) - imported}) + '\n'
+
+    return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/api/projects/<project_id>/download_zip', methods=['GET'])
 def download_project_zip(project_id):
     storage = Storage()
     project = storage.get_project(project_id)
     if not project:
         abort(404)
-    project_path = storage._get_project_path(project_id)
-    temp_dir = tempfile.gettempdir()
-    archive_base = os.path.join(temp_dir, project_id)
-    archive_path = shutil.make_archive(archive_base, 'zip', root_dir=project_path)
-    response = send_file(
-        archive_path,
-        as_attachment=True,
-        download_name=f"{project['name']}.zip",
-        mimetype='application/zip'
-    )
-    @response.call_on_close
-    def cleanup():
-        if os.path.exists(archive_path):
-            os.remove(archive_path)
+    store_compressed = request.args.get('store_compressed', type=int, default=int(app.config['ZIP_STORE_COMPRESSED']))
+    entries = iter_project_zip_entries(storage, project_id)
+    response = app.response_class(stream_zip(entries, store_compressed=bool(store_compressed)), mimetype='application/zip')
+    set_attachment_headers(response, f"{project['name']}.zip")
+    return response
+
+@app.route('/api/projects/<project_id>/export', methods=['GET'])
+def export_project(project_id):
+    # ?format=site（静态网页，默认）或 document（单个 HTML 文档，可在浏览器中打印为 PDF）；?note_ids=a,b 只导出选中的笔记
+    export_format = request.args.get('format', 'site')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'Invalid format'}), 400
+    storage = Storage()
+    project = storage.get_project(project_id)
+    if not project:
+        return jsonify({'error': 'Project not found'}), 404
+    notes = sorted(project['notes'], key=lambda n: n['created_at'])
+    if request.args.get('note_ids'):
+        by_id = {n['id']: n for n in notes}
+        note_ids = list(dict.fromkeys(i for i in request.args['note_ids'].split(',') if i))
+        unknown = [i for i in note_ids if i not in by_id]
+        if unknown:
+            return jsonify({'error': 'Unknown note ids', 'note_ids': unknown}), 400
+        notes = [by_id[i] for i in note_ids]
+    global _active_exports
+    with _export_lock:
+        if _active_exports >= app.config['EXPORT_MAX_CONCURRENT']:
+            return jsonify({'error': 'Too many exports in progress'}), 429
+        _active_exports += 1
+    processes = app.config['EXPORT_RENDER_PROCESSES'] or os.cpu_count()
+    entries = iter_export_entries(storage, project, notes, export_format, processes)
+    zip_stream = stream_zip(entries, store_compressed=app.config['ZIP_STORE_COMPRESSED'])
+    response = app.response_class(stream_with_context(zip_stream), mimetype='application/zip')
+    # 客户端中途断开时生成器可能从未启动，计数在响应关闭时归还
+    response.call_on_close(_finish_export)
+    set_attachment_headers(response, f"{project['name']}-{export_format}.zip")
     return response
 
 # ----- Note 相关接口 -----
@@ -314,6 +2869,20 @@ def create_note(project_id):
         return jsonify({'error': 'Project not found'}), 404
     return jsonify(serialize_object(note_meta)), 201
 
+@app.route('/api/projects/<project_id>/notes:batch', methods=['POST'])
+def batch_notes(project_id):
+    data = request.json
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'Missing operations'}), 400
+    if len(operations) > app.config['BATCH_MAX_OPERATIONS']:
+        return jsonify({'error': 'Too many operations'}), 400
+    storage = Storage()
+    results = storage.apply_note_batch(project_id, operations)
+    if results is None:
+        return jsonify({'error': 'Project not found'}), 404
+    return jsonify({'results': serialize_object(results)}), 200
+
 @app.route('/api/projects/<project_id>/notes/<note_id>', methods=['PUT'])
 def update_note(project_id, note_id):
     data = request.json
@@ -327,21 +2896,32 @@ def update_note(project_id, note_id):
         return jsonify({'error': 'Note not found'}), 404
     return jsonify(serialize_object(updated_note)), 200
 
+@app.route('/api/projects/<project_id>/notes/<note_id>', methods=['PATCH'])
+def patch_note(project_id, note_id):
+    # 请求体：{"base_hash": ..., "edits": [{"start", "end", "text"}, ...], "title": 可选}
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get('base_hash') or not isinstance(data.get('edits'), list):
+        return jsonify({'error': 'Missing base_hash or edits'}), 400
+    if data.get('title') is not None and not isinstance(data['title'], str):
+        return jsonify({'error': 'Invalid title'}), 400
+    storage = Storage()
+    try:
+        updated_note = storage.patch_note(project_id, note_id, data['base_hash'], data['edits'], data.get('title'))
+    except NoteConflictError as e:
+        return jsonify({'error': str(e), 'hash': e.current_hash}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not updated_note:
+        return jsonify({'error': 'Note not found'}), 404
+    return jsonify(serialize_object(updated_note)), 200
+
 @app.route('/api/projects/<project_id>/notes/<note_id>', methods=['DELETE'])
 def delete_note(project_id, note_id):
     storage = Storage()
-    project = storage.get_project(project_id)
-    if not project:
+    if not storage.has_project(project_id):
         return jsonify({'error': 'Project not found'}), 404
-    note_meta = next((n for n in project['notes'] if n['id'] == note_id), None)
-    if not note_meta:
+    if not storage.delete_note(project_id, note_id):
         return jsonify({'error': 'Note not found'}), 404
-    note_file = os.path.join(storage._get_project_path(project_id), f'{note_id}.md')
-    if os.path.exists(note_file):
-        os.remove(note_file)
-    project['notes'] = [n for n in project['notes'] if n['id'] != note_id]
-    project['updated_at'] = datetime.now().isoformat()
-    storage._save_project_meta(project_id, project)
     return jsonify({'message': 'Note deleted'}), 200
 
 @app.route('/api/projects/<project_id>/notes/<note_id>/move', methods=['PUT'])
@@ -351,28 +2931,60 @@ def move_note(project_id, note_id):
     if not target_project_id:
         return jsonify({'error': 'Missing target_project_id'}), 400
     storage = Storage()
-    source_project = storage.get_project(project_id)
-    target_project = storage.get_project(target_project_id)
-    if not source_project or not target_project:
+    if not storage.has_project(project_id) or not storage.has_project(target_project_id):
         return jsonify({'error': 'Source or target project not found'}), 404
-    note_meta = next((n for n in source_project['notes'] if n['id'] == note_id), None)
-    if not note_meta:
+    if not storage.get_note_meta(project_id, note_id):
         return jsonify({'error': 'Note not found in source project'}), 404
-    note_file_source = os.path.join(storage._get_project_path(project_id), f'{note_id}.md')
-    if not os.path.exists(note_file_source):
+    if not os.path.exists(storage._get_note_path(project_id, note_id)):
         return jsonify({'error': 'Note file not found'}), 404
-    target_project_dir = storage._get_project_path(target_project_id)
-    note_file_target = os.path.join(target_project_dir, f'{note_id}.md')
-    os.rename(note_file_source, note_file_target)
-    source_project['notes'] = [n for n in source_project['notes'] if n['id'] != note_id]
-    source_project['updated_at'] = datetime.now().isoformat()
-    storage._save_project_meta(project_id, source_project)
-    note_meta['updated_at'] = datetime.now().isoformat()
-    target_project['notes'].append(note_meta)
-    target_project['updated_at'] = datetime.now().isoformat()
-    storage._save_project_meta(target_project_id, target_project)
+    if not storage.move_note(project_id, note_id, target_project_id):
+        return jsonify({'error': 'Note not found in source project'}), 404
     return jsonify({'message': 'Note moved successfully'}), 200
 
+# ----- 笔记版本历史 -----
+@app.route('/api/projects/<project_id>/notes/<note_id>/revisions', methods=['GET'])
+def list_revisions(project_id, note_id):
+    revisions = Storage().get_revisions(project_id, note_id)
+    if revisions is None:
+        return jsonify({'error': 'Note not found'}), 404
+    return jsonify({'revisions': revisions}), 200
+
+@app.route('/api/projects/<project_id>/notes/<note_id>/revisions/<rev_hash>', methods=['GET'])
+def get_revision(project_id, note_id, rev_hash):
+    content = Storage().get_revision_content(project_id, note_id, rev_hash)
+    if content is None:
+        return jsonify({'error': 'Revision not found'}), 404
+    return jsonify({'hash': rev_hash, 'content': content}), 200
+
+@app.route('/api/projects/<project_id>/notes/<note_id>/revisions/<rev_hash>/diff', methods=['GET'])
+def diff_revision(project_id, note_id, rev_hash):
+    # 默认与当前内容比较，?against=<hash> 时与另一个版本比较
+    storage = Storage()
+    content = storage.get_revision_content(project_id, note_id, rev_hash)
+    if content is None:
+        return jsonify({'error': 'Revision not found'}), 404
+    against = request.args.get('against')
+    if against:
+        other = storage.get_revision_content(project_id, note_id, against)
+    else:
+        other = storage.get_note_content(project_id, note_id)
+    if other is None:
+        return jsonify({'error': 'Revision not found'}), 404
+    diff = ''.join(difflib.unified_diff(content.splitlines(keepends=True), other.splitlines(keepends=True),
+                                        fromfile=rev_hash, tofile=against or 'current'))
+    return jsonify({'from': rev_hash, 'to': against or 'current', 'diff': diff}), 200
+
+@app.route('/api/projects/<project_id>/notes/<note_id>/revisions/<rev_hash>/restore', methods=['POST'])
+def restore_revision(project_id, note_id, rev_hash):
+    note = Storage().restore_revision(project_id, note_id, rev_hash)
+    if not note:
+        return jsonify({'error': 'Revision not found'}), 404
+    return jsonify(serialize_object(note)), 200
+
+@app.route('/api/revisions/gc', methods=['POST'])
+def gc_revisions():
+    return jsonify(Storage().gc_revisions()), 200
+
 @app.route('/api/projects/<project_id>/notes/<note_id>/verify', methods=['GET'])
 def verify_note_hash(project_id, note_id):
     storage = Storage()
@@ -389,6 +3001,26 @@ def verify_note_hash(project_id, note_id):
     valid = (current_hash == note_meta.get('hash'))
     return jsonify({'valid': valid, 'stored_hash': note_meta.get('hash'), 'current_hash': current_hash}), 200
 
+# ----- 完整性检查 -----
+@app.route('/api/scrub', methods=['POST'])
+def start_scrub():
+    started, retry_after = start_background_scrub(Storage().data_dir)
+    if started:
+        return jsonify({'status': 'running'}), 202
+    if retry_after:
+        response = jsonify({'error': 'Scrub ran recently', 'retry_after': retry_after})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 429
+    return jsonify({'error': 'Scrub already running'}), 409
+
+@app.route('/api/scrub', methods=['GET'])
+def scrub_status():
+    return jsonify({
+        'status': 'running' if _scrub_job['running'] else 'idle',
+        'error': _scrub_job['error'],
+        'report': load_scrub_report(Storage().data_dir)
+    }), 200
+
 @app.route('/api/projects/<project_id>/notes/<note_id>/download', methods=['GET'])
 def download_note(project_id, note_id):
     storage = Storage()
@@ -398,7 +3030,7 @@ def download_note(project_id, note_id):
     note_meta = next((n for n in project['notes'] if n['id'] == note_id), None)
     if not note_meta:
         abort(404)
-    note_file = os.path.join(storage._get_project_path(project_id), f'{note_id}.md')
+    note_file = storage._get_note_path(project_id, note_id)
     if not os.path.exists(note_file):
         abort(404)
     return send_file(
@@ -411,40 +3043,66 @@ def download_note(project_id, note_id):
 # ----- Image 相关接口 -----
 @app.route('/api/upload_image', methods=['POST'])
 def upload_image():
+    max_size = app.config['MAX_IMAGE_SIZE']
+    # 请求体明显超限时直接拒绝，不再解析表单
+    if request.content_length and request.content_length > max_size + 64 * 1024:
+        return jsonify({'error': '图片超过大小限制'}), 413
     if 'file' not in request.files:
         return jsonify({'error': '没有文件部分'}), 400
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': '未选择文件'}), 400
 
-    file_bytes = file.read()
-    file_hash = hashlib.sha256(file_bytes).hexdigest()
     ext = os.path.splitext(file.filename)[1]
     date_path = datetime.now().strftime("%Y/%m/%d")
     upload_folder = os.path.join(app.root_path, 'static', 'uploads', date_path)
     os.makedirs(upload_folder, exist_ok=True)
-    filename = f"{file_hash}{ext}"
-    file_path = os.path.join(upload_folder, filename)
 
-    gs = ImageStorage()
-    images = gs.get_all_images()
-    for img in images:
-        if img.get('filename') == filename:
-            return jsonify({'url': img['url'], 'md': f"![]({img['url']})"}), 200
-
-    file.seek(0)
-    file.save(file_path)
-    file_url = url_for('static', filename=f'uploads/{date_path}/{filename}', _external=True)
-    image_obj = Image(filename=filename, url=file_url)
-    gs.add_image(image_obj.to_dict())
+    # 分块写入上传目录下的临时文件，同时增量计算哈希
+    fd, temp_path = tempfile.mkstemp(dir=upload_folder, suffix='.part')
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            while True:
+                chunk = file.stream.read(64 * 1024)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    break
+                hasher.update(chunk)
+                temp_file.write(chunk)
+        if size > max_size:
+            os.remove(temp_path)
+            return jsonify({'error': '图片超过大小限制'}), 413
+        file_hash = hasher.hexdigest()
+        filename = f"{file_hash}{ext}"
+        file_path = os.path.join(upload_folder, filename)
+
+        # 查重与登记在登记锁内完成，多个进程同时上传同一张图片时只登记一次
+        gs = ImageStorage()
+        with gs.lock():
+            img = gs.get_image_by_hash(file_hash)
+            if img:
+                os.remove(temp_path)
+                return jsonify({'url': img['url'], 'md': f"![]({img['url']})"}), 200
+            os.replace(temp_path, file_path)
+            file_url = url_for('static', filename=f'uploads/{date_path}/{filename}', _external=True)
+            image_obj = Image(filename=filename, url=file_url, file_hash=file_hash)
+            gs.add_image(image_obj.to_dict())
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    schedule_thumbnail(file_path)
     markdown_text = f"![]({file_url})"
     return jsonify({'url': file_url, 'md': markdown_text}), 200
 
 @app.route('/api/images/<image_id>', methods=['DELETE'])
 def delete_image(image_id):
     gs = ImageStorage()
-    images = gs.get_all_images()
-    image = next((img for img in images if img['id'] == image_id), None)
+    image = gs.delete_image(image_id)
     if not image:
         return jsonify({'error': '图片未找到'}), 404
 
@@ -453,32 +3111,111 @@ def delete_image(image_id):
         file_path = os.path.join(app.root_path, 'static', static_part)
         if os.path.exists(file_path):
             os.remove(file_path)
+        if os.path.exists(thumbnail_path(file_path)):
+            os.remove(thumbnail_path(file_path))
     except Exception as e:
         print(e)
-
-    images = [img for img in images if img['id'] != image_id]
-    with open(gs.filename, 'w', encoding='utf-8') as f:
-        json.dump(serialize_object(images), f, indent=2, ensure_ascii=False)
     return jsonify({'message': '图片已删除'}), 200
 
+# ----- 搜索接口 -----
+@app.route('/api/search', methods=['GET'])
+def search_notes():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing q'}), 400
+    project_id = request.args.get('project_id') or None
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    storage = Storage()
+    if project_id and not storage.has_project(project_id):
+        return jsonify({'error': 'Project not found'}), 404
+    started = time.perf_counter()
+    results = storage.search(query, project_id=project_id, limit=limit)
+    took_ms = round((time.perf_counter() - started) * 1000, 3)
+    return jsonify({'query': query, 'results': results, 'took_ms': took_ms}), 200
+
+# ----- 缓存统计 -----
+@app.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({'metadata': metadata_cache.stats(), 'render': render_cache.stats()}), 200
+
+# ----- 请求指标 -----
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 # ----- Gallery 页面 -----
 @app.route('/gallery')
 def gallery():
     gs = ImageStorage()
-    images = gs.get_all_images()
-    return render_template('gallery.html', images=images)
+    page = gs.page_images(limit=app.config['PAGE_SIZE'])
+    images = [_with_thumb_url(img) for img in page['items']]
+    return render_template('gallery.html', images=images, next_cursor=page['next_cursor'])
+
+@app.route('/static/uploads/<path:filename>')
+def uploaded_file(filename):
+    # 上传文件以内容哈希命名，同一路径的内容不会变化，可以长期缓存；
+    # send_from_directory 会交给服务器的 wsgi.file_wrapper 发送（gunicorn 下为 sendfile 零拷贝）
+    response = send_from_directory(os.path.join(app.root_path, 'static', 'uploads'), filename,
+                                   max_age=app.config['UPLOAD_CACHE_MAX_AGE'])
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/thumbnails/<path:filename>')
+def image_thumbnail(filename):
+    # 只为图片登记中的上传文件生成缩略图，缩略图本身和未登记的文件不处理
+    if filename.endswith('.thumb.jpg'):
+        abort(404)
+    image = ImageStorage().get_image_by_hash(os.path.splitext(os.path.basename(filename))[0])
+    if image is None or image['url'].split('/static/uploads/', 1)[-1] != filename:
+        abort(404)
+    original_path = safe_join(os.path.join(app.root_path, 'static', 'uploads'), filename)
+    if original_path is None or not os.path.isfile(original_path):
+        abort(404)
+    # 后台任务尚未完成或历史图片没有缩略图时，在当前请求中生成
+    thumb_path = generate_thumbnail(original_path)
+    if thumb_path is None:
+        return send_file(original_path, max_age=86400)
+    response = send_file(thumb_path, mimetype='image/jpeg', max_age=31536000)
+    response.cache_control.immutable = True
+    return response
 
 # ---------------------- after_request 钩子 ----------------------
 @app.after_request
 def add_cors_headers(response):
     response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS, PUT, DELETE"
+    response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS, PUT, PATCH, DELETE"
     response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
     return response
 
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    # 流式响应（如 ZIP 导出）只统计到开始发送为止
+    duration = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_histogram.observe((request.method, route, str(response.status_code)), duration)
+    timings = g.timings
+    for phase, seconds in timings.items():
+        phase_histogram.observe((route, phase), seconds)
+    response.headers['Server-Timing'] = ', '.join(
+        [f'app;dur={duration * 1000:.2f}'] + [f'{phase};dur={timings[phase] * 1000:.2f}' for phase in METRIC_PHASES if phase in timings])
+    if g.pop('profiling', False):
+        counts = profiler.stop(threading.get_ident())
+        if counts and duration >= app.config['PROFILE_SLOW_REQUESTS']:
+            _write_profile(route, duration, counts)
+    return response
+
 if __name__ == '__main__':
     if not os.path.exists(app.config['DATA_DIR']):
         os.makedirs(app.config['DATA_DIR'])
+    if len(sys.argv) >= 2 and sys.argv[1] == 'scrub':
+        # python app.py scrub [--full]：输出 JSON 报告，发现问题时退出码为 1
+        scrub_report = scrub_data_dir(full='--full' in sys.argv[2:], processes=app.config['SCRUB_PROCESSES'])
+        print(json.dumps(scrub_report, ensure_ascii=False, indent=2))
+        sys.exit(0 if scrub_report['ok'] else 1)
+    import webbrowser
     if len(sys.argv) == 3 and sys.argv[1] == 'port':
         webbrowser.open(f'http://localhost:{sys.argv[2]}')
         app.run(host='0.0.0.0', port=int(sys.argv[2]))
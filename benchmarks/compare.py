@@ -0,0 +1,56 @@
+# 比较两次基准测试输出的 JSON，逐项列出 p50/p95 的变化
+# 用法：python benchmarks/compare.py baseline.json current.json [--metric p50_ms] [--threshold 10]
+import sys
+import json
+import argparse
+
+def flatten(results, prefix=''):
+    # 找出所有带延迟统计的叶子节点，键名以 "/" 连接
+    rows = {}
+    for key, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        name = f'{prefix}/{key}' if prefix else key
+        if 'p50_ms' in value:
+            rows[name] = value
+        else:
+            rows.update(flatten(value, name))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='比较两次基准测试结果')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--metric', default='p50_ms', choices=['mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+    parser.add_argument('--threshold', type=float, default=10.0, help='变慢超过该百分比时以非零状态退出')
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    if baseline.get('benchmark') != current.get('benchmark'):
+        print(f"警告：比较的是不同的基准（{baseline.get('benchmark')} / {current.get('benchmark')}）", file=sys.stderr)
+
+    old_rows = flatten(baseline['results'])
+    new_rows = flatten(current['results'])
+    comparison = {}
+    regressions = []
+    for name in sorted(set(old_rows) & set(new_rows)):
+        old = old_rows[name][args.metric]
+        new = new_rows[name][args.metric]
+        change = round((new - old) / old * 100, 1) if old else None
+        comparison[name] = {'baseline': old, 'current': new, 'change_pct': change}
+        if change is not None and change > args.threshold:
+            regressions.append(name)
+    print(json.dumps({
+        'metric': args.metric,
+        'baseline_commit': baseline.get('environment', {}).get('commit'),
+        'current_commit': current.get('environment', {}).get('commit'),
+        'comparison': comparison,
+        'regressions': regressions
+    }, ensure_ascii=False, indent=2))
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+# 基准测试用的公共部分：生成合成数据目录、计时统计与 JSON 结果输出
+# 单独运行时生成一个数据目录，供 server.py --data-dir 启动后用 load_test.py --url 压测：
+#   python benchmarks/datagen.py --out /tmp/mns-bench --projects 50 --notes 100 --note-size 4000 --images 500
+import os
+import sys
+import json
+import time
+import random
+import struct
+import zlib
+import hashlib
+import argparse
+import platform
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import app  # noqa: E402
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+         '笔记 课程 定理 证明 推论 公式 数据 结构 算法 复杂度 矩阵 向量 概率 分布 函数').split()
+
+def use_sandbox(root=None, backend=None):
+    # 把数据目录和上传目录都指向临时目录，基准测试不会写入仓库的 data/ 与 static/
+    # Flask 的模板加载器在首次访问时按 root_path 创建，需先创建好再修改 root_path
+    root = os.path.abspath(root or tempfile.mkdtemp(prefix='mns-bench-'))
+    app.app.jinja_loader
+    app.app.root_path = root
+    app.app.config['DATA_DIR'] = os.path.join(root, 'data')
+    if backend:
+        app.app.config['STORAGE_BACKEND'] = backend
+    os.makedirs(app.app.config['DATA_DIR'], exist_ok=True)
+    return root
+
+def drain_background():
+    # 等待缩略图、日志压缩、索引快照等后台任务结束并写出搜索索引，之后才能安全删除临时目录
+    for name in ('_thumbnail_executor', '_journal_executor', '_revision_gc_executor', '_prerender_executor', '_search_flush_executor'):
+        executor = getattr(app, name, None)
+        if executor is not None:
+            executor.shutdown(wait=True)
+    app.get_search_index(app.app.config['DATA_DIR']).flush()
+
+def make_note(rng, size):
+    # 生成约 size 个字符的 Markdown：标题、段落、列表、代码块与公式
+    parts = []
+    total = 0
+    section = 0
+    while total < size:
+        kind = rng.random()
+        if kind < 0.12:
+            section += 1
+            part = f"## 第 {section} 节 {rng.choice(WORDS)}\n\n"
+        elif kind < 0.3:
+            part = ''.join(f"- {' '.join(rng.choices(WORDS, k=6))}\n" for _ in range(rng.randint(2, 6))) + "\n"
+        elif kind < 0.4:
+            part = "```python\n" + ''.join(f"x_{i} = {rng.randint(0, 999)}\n" for i in range(rng.randint(2, 8))) + "```\n\n"
+        elif kind < 0.5:
+            part = f"$$\\sum_{{i=1}}^{{{rng.randint(2, 99)}}} a_i x^i$$\n\n"
+        else:
+            part = ' '.join(rng.choices(WORDS, k=rng.randint(20, 60))) + "。\n\n"
+        parts.append(part)
+        total += len(part)
+    return ''.join(parts)
+
+def make_png(rng, width=64, height=64):
+    # 纯色 PNG，不依赖 Pillow；颜色随机，保证每张图片的内容哈希不同
+    color = bytes(rng.randrange(256) for _ in range(3))
+    raw = b''.join(b'\x00' + color * width for _ in range(height))
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+def generate_data(projects=10, notes=50, note_size=2000, images=100, seed=0):
+    # 通过 Storage / ImageStorage 写入，得到与真实使用一致的元数据、日志与哈希
+    rng = random.Random(seed)
+    storage = app.Storage()
+    started = time.perf_counter()
+    project_ids = []
+    for p in range(projects):
+        project_id = storage.create_project(f'Project {p}')['id']
+        project_ids.append(project_id)
+        operations = [{'op': 'create', 'title': f'Note {p}-{n}', 'content': make_note(rng, note_size)} for n in range(notes)]
+        storage.apply_note_batch(project_id, operations)
+
+    image_storage = app.ImageStorage()
+    upload_dir = os.path.join(app.app.root_path, 'static', 'uploads', 'bench')
+    os.makedirs(upload_dir, exist_ok=True)
+    for i in range(images):
+        data = make_png(rng)
+        file_hash = hashlib.sha256(data).hexdigest()
+        filename = f'{file_hash}.png'
+        with open(os.path.join(upload_dir, filename), 'wb') as f:
+            f.write(data)
+        image = app.Image(filename=filename, url=f'http://localhost/static/uploads/bench/{filename}', file_hash=file_hash)
+        image_storage.add_image(image.to_dict())
+    return {
+        'projects': projects, 'notes_per_project': notes, 'note_size': note_size, 'images': images, 'seed': seed,
+        'project_ids': project_ids, 'generate_s': round(time.perf_counter() - started, 3)
+    }
+
+def summarize(samples):
+    # samples 为秒，输出毫秒
+    if not samples:
+        return {'n': 0}
+    ordered = sorted(samples)
+
+    def percentile(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000
+
+    return {
+        'n': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 4),
+        'p50_ms': round(percentile(0.5), 4),
+        'p95_ms': round(percentile(0.95), 4),
+        'p99_ms': round(percentile(0.99), 4),
+        'min_ms': round(ordered[0] * 1000, 4),
+        'max_ms': round(ordered[-1] * 1000, 4)
+    }
+
+def measure(func, repeat, warmup=1):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit,
+        'storage_backend': app.app.config['STORAGE_BACKEND'],
+        'pillow': app.PIL_AVAILABLE
+    }
+
+def write_results(name, params, results, output=None):
+    report = {
+        'benchmark': name,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment(),
+        'params': params,
+        'results': results
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+    return report
+
+def add_data_arguments(parser):
+    parser.add_argument('--projects', type=int, default=10)
+    parser.add_argument('--notes', type=int, default=50, help='每个项目的笔记数')
+    parser.add_argument('--note-size', type=int, default=2000, help='每条笔记的大约字符数')
+    parser.add_argument('--images', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成数据目录')
+    parser.add_argument('--out', required=True, help='输出目录，数据写入 <out>/data，图片写入 <out>/static/uploads')
+    add_data_arguments(parser)
+    args = parser.parse_args()
+    use_sandbox(args.out, args.backend)
+    info = generate_data(args.projects, args.notes, args.note_size, args.images, args.seed)
+    info.pop('project_ids')
+    info['data_dir'] = app.app.config['DATA_DIR']
+    print(json.dumps(info, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
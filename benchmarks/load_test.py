@@ -0,0 +1,209 @@
+# HTTP 层并发压测：多个线程按权重混合发送读写请求，统计各接口的延迟分位数与吞吐量
+# 默认在临时目录生成数据并通过 Flask 测试客户端在进程内施压；
+# 指定 --url 时改为请求已启动的服务（先用 datagen.py 生成数据，再 python server.py --data-dir <out>/data）
+# 用法：python benchmarks/load_test.py [--threads 8] [--duration 10] [--url http://127.0.0.1:5000] [--output result.json]
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import datagen  # noqa: E402
+from datagen import app, summarize  # noqa: E402
+
+# (操作名, 权重)
+MIX = [
+    ('index', 10),
+    ('list_projects', 10),
+    ('list_notes', 15),
+    ('project_detail', 10),
+    ('preview', 20),
+    ('search', 10),
+    ('update', 10),
+    ('patch', 5),
+    ('upload', 5),
+    ('gallery', 5)
+]
+
+class TestClientTransport:
+    def __init__(self):
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = app.app.test_client()
+        return client
+
+    def request(self, method, path, body=None, files=None):
+        kwargs = {}
+        if body is not None:
+            kwargs['json'] = body
+        if files:
+            kwargs['data'] = {name: (io.BytesIO(data), filename) for name, (filename, data) in files.items()}
+            kwargs['content_type'] = 'multipart/form-data'
+        response = self._client().open(path, method=method, **kwargs)
+        data = response.get_data()
+        response.close()
+        return response.status_code, data
+
+class HttpTransport:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body=None, files=None):
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if files:
+            boundary = '----mns-bench-%x' % random.getrandbits(64)
+            parts = []
+            for name, (filename, content) in files.items():
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                             f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + content + b'\r\n')
+            data = b''.join(parts) + f'--{boundary}--\r\n'.encode('utf-8')
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+def discover(transport):
+    # 通过公开接口收集项目与笔记 id，两种模式下的准备工作一致
+    status, body = transport.request('GET', '/api/projects?limit=100')
+    if status != 200:
+        raise SystemExit(f'无法获取项目列表：HTTP {status}')
+    notes = []
+    for project in json.loads(body)['items']:
+        status, body = transport.request('GET', f"/api/projects/{project['id']}/notes?limit=100")
+        if status == 200:
+            notes.extend((project['id'], n['id']) for n in json.loads(body)['items'])
+    if not notes:
+        raise SystemExit('数据目录中没有笔记，请先生成数据')
+    return sorted({p for p, _ in notes}), notes
+
+def run_operation(op, transport, rng, projects, notes):
+    # 返回 (状态码, 是否计为成功)；409 冲突是并发编辑下的正常结果
+    project_id, note_id = rng.choice(notes)
+    note_path = f'/api/projects/{project_id}/notes/{note_id}'
+    if op == 'index':
+        status, _ = transport.request('GET', '/')
+    elif op == 'list_projects':
+        status, _ = transport.request('GET', '/api/projects?limit=30')
+    elif op == 'list_notes':
+        status, _ = transport.request('GET', f'/api/projects/{rng.choice(projects)}/notes?limit=30')
+    elif op == 'project_detail':
+        status, _ = transport.request('GET', f'/projects/{rng.choice(projects)}')
+    elif op == 'preview':
+        status, _ = transport.request('GET', f'/projects/{project_id}/notes/{note_id}/preview')
+    elif op == 'search':
+        status, _ = transport.request('GET', '/api/search?q=' + urllib.parse.quote(' '.join(rng.sample(datagen.WORDS, 2))))
+    elif op == 'update':
+        content = datagen.make_note(rng, 1000)
+        status, _ = transport.request('PUT', note_path, {'title': f'Load {rng.randrange(10 ** 6)}', 'content': content})
+    elif op == 'patch':
+        status, body = transport.request('GET', note_path + '/verify')
+        if status == 200:
+            base_hash = json.loads(body)['stored_hash']
+            status, _ = transport.request('PATCH', note_path, {'base_hash': base_hash,
+                                                               'edits': [{'start': 0, 'end': 0, 'text': 'x'}]})
+            return status, status in (200, 409)
+    elif op == 'upload':
+        status, _ = transport.request('POST', '/api/upload_image', files={'file': ('bench.png', datagen.make_png(rng))})
+    elif op == 'gallery':
+        status, _ = transport.request('GET', '/gallery')
+    else:
+        raise ValueError(op)
+    return status, 200 <= status < 300
+
+def worker(index, transport, projects, notes, deadline, max_requests, seed, records):
+    rng = random.Random(seed * 1000 + index)
+    names = [name for name, _ in MIX]
+    weights = [weight for _, weight in MIX]
+    count = 0
+    while time.perf_counter() < deadline and (not max_requests or count < max_requests):
+        op = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            status, ok = run_operation(op, transport, rng, projects, notes)
+        except Exception as e:
+            status, ok = type(e).__name__, False
+        records.append((op, time.perf_counter() - started, status, ok))
+        count += 1
+
+def run_load(transport, threads, duration, max_requests, seed):
+    projects, notes = discover(transport)
+    records = []
+    started = time.perf_counter()
+    deadline = started + duration
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [pool.submit(worker, i, transport, projects, notes, deadline, max_requests, seed, records)
+                   for i in range(threads)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    by_op = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    errors = defaultdict(int)
+    for op, seconds, status, ok in records:
+        by_op[op].append(seconds)
+        statuses[op][str(status)] += 1
+        if not ok:
+            errors[op] += 1
+    operations = {}
+    for op, samples in sorted(by_op.items()):
+        operations[op] = dict(summarize(samples), errors=errors[op], statuses=dict(statuses[op]),
+                              rps=round(len(samples) / elapsed, 2))
+    return {
+        'requests': len(records),
+        'errors': sum(errors.values()),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(records) / elapsed, 2),
+        'latency': summarize([seconds for _, seconds, _, _ in records]),
+        'operations': operations
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP 层并发压测')
+    datagen.add_data_arguments(parser)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='压测时长（秒）')
+    parser.add_argument('--requests', type=int, default=0, help='每个线程的最大请求数，0 表示只按时长')
+    parser.add_argument('--url', help='压测已启动的服务，而非进程内的测试客户端')
+    parser.add_argument('--workdir', help='进程内模式的数据目录，默认使用临时目录并在结束后删除')
+    parser.add_argument('--output', help='把 JSON 结果同时写入该文件')
+    args = parser.parse_args()
+
+    if args.url:
+        results = run_load(HttpTransport(args.url), args.threads, args.duration, args.requests, args.seed)
+        datagen.write_results('load_test', vars(args), results, args.output)
+        return
+
+    root = datagen.use_sandbox(args.workdir, args.backend)
+    try:
+        data = datagen.generate_data(args.projects, args.notes, args.note_size, args.images, args.seed)
+        results = run_load(TestClientTransport(), args.threads, args.duration, args.requests, args.seed)
+        params = dict(vars(args), generate_s=data['generate_s'])
+        datagen.write_results('load_test', params, results, args.output)
+    finally:
+        datagen.drain_background()
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
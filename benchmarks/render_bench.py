@@ -0,0 +1,74 @@
+# 预览渲染微基准：对比每次调用 markdown.markdown 与复用转换器的耗时
+# 用法：python benchmarks/render_bench.py [--repeat 200] [--batch 200]
+import os
+import sys
+import json
+import time
+import argparse
+import markdown
+from dominate.tags import div
+from dominate.util import raw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+SAMPLES = {
+    'small': "# 标题\n\n一段简短的笔记，包含 **加粗** 和 `代码`。\n",
+    'medium': "\n\n".join(
+        f"## 第 {i} 节\n\n正文 $x^{i}$ 与 [链接](https://example.com/{i})。\n\n| a | b |\n|---|---|\n| {i} | {i * 2} |\n\n```python\nprint({i})\n```"
+        for i in range(20)
+    ),
+    'large': "\n\n".join(f"### 段落 {i}\n\n" + "Lorem ipsum dolor sit amet 中文内容 " * 20 for i in range(300)),
+}
+
+def legacy_render(md_content):
+    # 改动前的实现：每次构建新的 Markdown 实例并加载扩展
+    html = markdown.markdown(md_content, extensions=app.MARKDOWN_EXTENSIONS)
+    container = div(_class="card")
+    card_body = div(_class="card-body")
+    card_body.add(raw(html))
+    container.add(card_body)
+    return str(container)
+
+def measure(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=200)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    results = {}
+    for name, content in SAMPLES.items():
+        assert legacy_render(content) == app.render_markdown_with_bootstrap(content)
+        repeat = max(1, args.repeat // (10 if name == 'large' else 1))
+        legacy_ms = measure(lambda: legacy_render(content), repeat)
+        pooled_ms = measure(lambda: app.render_markdown_with_bootstrap(content), repeat)
+        results[name] = {
+            'legacy_ms': round(legacy_ms, 4),
+            'pooled_ms': round(pooled_ms, 4),
+            'speedup': round(legacy_ms / pooled_ms, 2)
+        }
+
+    batch = [SAMPLES['medium']] * args.batch
+    started = time.perf_counter()
+    app.render_markdown_batch(batch)
+    sequential_s = time.perf_counter() - started
+    started = time.perf_counter()
+    app.render_markdown_batch(batch, processes=args.processes)
+    parallel_s = time.perf_counter() - started
+    results['batch'] = {
+        'notes': args.batch,
+        'processes': args.processes,
+        'sequential_s': round(sequential_s, 4),
+        'parallel_s': round(parallel_s, 4)
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# 存储层与渲染的微基准：Storage、ImageStorage 与 render_markdown_with_bootstrap
+# 在临时目录中生成合成数据后逐项计时，结果以 JSON 输出，便于用 compare.py 比较两次运行
+# 用法：python benchmarks/storage_bench.py [--projects 10] [--notes 50] [--backend sqlite] [--output result.json]
+import os
+import sys
+import random
+import shutil
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import datagen  # noqa: E402
+from datagen import app, measure  # noqa: E402
+
+def bench_storage(project_ids, repeat, rng):
+    storage = app.Storage()
+    results = {}
+
+    def cold(func):
+        # 清空元数据缓存后再调用，测量从磁盘加载的开销
+        def run():
+            app.metadata_cache = app.MetadataCache()
+            return func()
+        return run
+
+    results['get_projects'] = measure(storage.get_projects, repeat)
+    results['get_projects_cold'] = measure(cold(storage.get_projects), repeat)
+    results['page_projects'] = measure(lambda: storage.page_projects(limit=30), repeat)
+    results['get_project'] = measure(lambda: storage.get_project(rng.choice(project_ids)), repeat)
+    results['get_project_cold'] = measure(cold(lambda: storage.get_project(rng.choice(project_ids))), repeat)
+    results['page_notes'] = measure(lambda: storage.page_notes(rng.choice(project_ids), limit=30), repeat)
+
+    project_id = project_ids[0]
+    notes = storage.get_project(project_id)['notes']
+    note_ids = [n['id'] for n in notes]
+    results['get_note_content'] = measure(lambda: storage.get_note_content(project_id, rng.choice(note_ids)), repeat)
+
+    counter = [0]
+
+    def update():
+        counter[0] += 1
+        note_id = note_ids[counter[0] % len(note_ids)]
+        storage.update_note(project_id, note_id, f'Updated {counter[0]}', f'# Updated\n\nrevision {counter[0]}\n')
+
+    results['update_note'] = measure(update, repeat)
+
+    note_id = note_ids[0]
+
+    def patch():
+        note_meta = storage.get_note_meta(project_id, note_id)
+        storage.patch_note(project_id, note_id, note_meta['hash'], [{'start': 0, 'end': 0, 'text': 'x'}])
+
+    results['patch_note'] = measure(patch, repeat)
+    results['create_note'] = measure(lambda: storage.create_note(project_id, 'Bench note'), repeat)
+
+    storage.search_index.ensure_loaded(storage)
+    results['search'] = measure(lambda: storage.search(' '.join(rng.sample(datagen.WORDS, 2))), repeat)
+    return results
+
+def bench_images(repeat, rng):
+    image_storage = app.ImageStorage()
+    images = image_storage.get_all_images()
+    hashes = [app._image_hash(img) for img in images] or ['0' * 64]
+    results = {
+        'get_all_images': measure(image_storage.get_all_images, repeat),
+        'page_images': measure(lambda: image_storage.page_images(limit=30), repeat),
+        'get_image_by_hash': measure(lambda: image_storage.get_image_by_hash(rng.choice(hashes)), repeat)
+    }
+
+    def add():
+        file_hash = '%064x' % rng.getrandbits(256)
+        image = app.Image(filename=f'{file_hash}.png', url=f'http://localhost/static/uploads/bench/{file_hash}.png',
+                          file_hash=file_hash)
+        image_storage.add_image(image.to_dict())
+
+    results['add_image'] = measure(add, repeat)
+    return results
+
+def bench_render(repeat, rng):
+    results = {}
+    for size in (1000, 10000, 100000):
+        content = datagen.make_note(rng, size)
+        results[f'render_markdown_{size}'] = measure(lambda: app.render_markdown_with_bootstrap(content), repeat)
+        results[f'render_note_html_cached_{size}'] = measure(lambda: app.render_note_html(content), repeat)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='存储层与渲染微基准')
+    datagen.add_data_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--workdir', help='数据目录位置，默认使用临时目录并在结束后删除')
+    parser.add_argument('--output', help='把 JSON 结果同时写入该文件')
+    args = parser.parse_args()
+
+    root = datagen.use_sandbox(args.workdir, args.backend)
+    try:
+        data = datagen.generate_data(args.projects, args.notes, args.note_size, args.images, args.seed)
+        rng = random.Random(args.seed)
+        results = {
+            'storage': bench_storage(data.pop('project_ids'), args.repeat, rng),
+            'images': bench_images(args.repeat, rng),
+            'render': bench_render(max(args.repeat // 10, 5), rng)
+        }
+        params = dict(vars(args), generate_s=data['generate_s'])
+        datagen.write_results('storage_bench', params, results, args.output)
+    finally:
+        datagen.drain_background()
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# 生产环境启动入口
+# 默认单进程多线程（waitress，未安装时退回 werkzeug 的多线程服务器）；
+# --workers 大于 1 时使用 gunicorn 多进程（仅 POSIX），每个进程内仍为多线程或 --worker-class 指定的异步模型。
+#   python server.py --port 8000 --threads 8
+#   python server.py --workers 4 --threads 4
+import argparse
+import os
+import signal
+import sys
+import threading
+
+def load_app(overrides):
+    # 导入应用并应用命令行参数；gunicorn 多进程时在各 worker 中调用，主进程不导入应用
+    import app as note_app
+    note_app.app.config.update(overrides)
+    os.makedirs(note_app.app.config['DATA_DIR'], exist_ok=True)
+    return note_app.app
+
+def serve_waitress(flask_app, host, port, threads):
+    from waitress import create_server
+    server = create_server(flask_app, host=host, port=port, threads=threads)
+
+    def stop(signum, frame):
+        # 停止接收新连接，已在处理的请求在工作线程中完成
+        server.close()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f'Serving on http://{host}:{port} (waitress, {threads} threads)')
+    try:
+        server.run()
+    except OSError:
+        # close() 之后 select 可能在已关闭的套接字上返回错误
+        pass
+
+def serve_werkzeug(flask_app, host, port):
+    from werkzeug.serving import make_server
+    server = make_server(host, port, flask_app, threaded=True)
+
+    def stop(signum, frame):
+        # shutdown() 会等待 serve_forever 退出，不能在其所在的线程中直接调用
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f'Serving on http://{host}:{port} (werkzeug threaded server; install waitress for production use)')
+    server.serve_forever()
+    server.server_close()
+
+def serve_gunicorn(overrides, host, port, workers, threads, worker_class, timeout):
+    from gunicorn.app.base import BaseApplication
+
+    class NoteApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', worker_class)
+            self.cfg.set('graceful_timeout', timeout)
+            self.cfg.set('timeout', max(timeout, 120))
+            # 不预加载应用：主进程不导入 app，各 worker 在 fork 之后自行导入并初始化缓存与后台线程，不会继承锁与线程池
+            self.cfg.set('preload_app', False)
+
+        def load(self):
+            return load_app(overrides)
+
+    NoteApplication().run()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Markdown Note System server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='进程数；大于 1 时需要 gunicorn，全文索引在每个进程内各自维护')
+    parser.add_argument('--threads', type=int, default=8, help='每个进程的工作线程数')
+    parser.add_argument('--worker-class', default='gthread',
+                        help='gunicorn 的 worker 类型，如 gthread、gevent（仅 --workers > 1 时有效）')
+    parser.add_argument('--graceful-timeout', type=int, default=30, help='停止时等待处理中请求的秒数（gunicorn）')
+    parser.add_argument('--x-sendfile', action='store_true',
+                        help='由前置服务器（Apache/lighttpd 等）通过 X-Sendfile 发送文件')
+    parser.add_argument('--data-dir', help='数据目录，默认为 app.py 所在目录下的 data')
+    parser.add_argument('--profile-slow', type=float, metavar='SECONDS',
+                        help='对耗时不少于该秒数的请求写出调用栈采样（火焰图数据，保存在 DATA_DIR/.profiles）')
+    args = parser.parse_args(argv)
+
+    overrides = {'USE_X_SENDFILE': args.x_sendfile}
+    if args.data_dir:
+        overrides['DATA_DIR'] = os.path.abspath(args.data_dir)
+    if args.profile_slow is not None:
+        overrides['PROFILE_SLOW_REQUESTS'] = args.profile_slow
+
+    if args.workers > 1:
+        if os.name != 'posix':
+            sys.exit('--workers > 1 requires gunicorn, which only runs on POSIX systems')
+        try:
+            import gunicorn
+        except ImportError:
+            sys.exit('--workers > 1 requires gunicorn: pip install gunicorn')
+        # 元数据缓存、图片登记与渲染缓存按文件版本校验，写入有跨进程文件锁；全文索引只在本进程内增量更新
+        print('Warning: the full-text search index is kept per process; '
+              'search results may lag behind edits made through other workers until they restart.', file=sys.stderr)
+        serve_gunicorn(overrides, args.host, args.port, args.workers, args.threads, args.worker_class, args.graceful_timeout)
+        return
+    flask_app = load_app(overrides)
+    try:
+        import waitress
+    except ImportError:
+        serve_werkzeug(flask_app, args.host, args.port)
+    else:
+        serve_waitress(flask_app, args.host, args.port, args.threads)
+
+if __name__ == '__main__':
+    main()